@@ -0,0 +1,74 @@
+"""Benchmark for the start_game setup path.
+
+Creates rooms with 4..7 ready players in a throwaway database and times
+start_game() in-process, then starts a burst of rooms from several threads the
+way a lobby rush does.
+
+    python bench_start_game.py --rooms 200 --target-ms 5
+
+Exits with status 1 when the p95 latency of any player count exceeds the target
+(p99 is reported as well; on a plain disk it mostly measures fsync jitter).
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loadgen import percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=200, help="rooms per player count")
+    parser.add_argument("--burst", type=int, default=50, help="rooms started concurrently in the burst test")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--target-ms", type=float, default=5.0, help="p95 latency budget per start_game")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bang-bench-")
+    os.environ["BANG_DATABASE_URL"] = os.path.join(db_dir, "bench.db")
+    import main as game
+    game.warm_up()
+
+    next_room = iter(range(1, 10 ** 9))
+
+    def prepare_room(num_players: int) -> int:
+        room_id = next(next_room)
+        game.create_room(room_id)
+        for i in range(num_players):
+            player_id = game.add_player(room_id, f"bot{i}")["player_id"]
+            game.set_ready(room_id, player_id)
+        return room_id
+
+    def timed_start(room_id: int) -> float:
+        started = time.perf_counter()
+        game.start_game(room_id)
+        return (time.perf_counter() - started) * 1000
+
+    failed = False
+    print(f"{'players':>7} {'rooms':>6} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for num_players in (4, 5, 6, 7):
+        rooms = [prepare_room(num_players) for _ in range(args.rooms)]
+        samples = [timed_start(room_id) for room_id in rooms]
+        p95 = percentile(samples, 0.95)
+        failed |= p95 > args.target_ms
+        print(f"{num_players:>7} {len(samples):>6} {statistics.mean(samples):>8.3f} "
+              f"{percentile(samples, 0.5):>7.3f} {p95:>7.3f} {percentile(samples, 0.99):>7.3f}")
+
+    rooms = [prepare_room(7) for _ in range(args.burst)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        samples = list(pool.map(timed_start, rooms))
+    wall = (time.perf_counter() - started) * 1000
+    print(f"burst: {args.burst} rooms x 7 players on {args.threads} threads in {wall:.1f} ms "
+          f"(p99 {percentile(samples, 0.99):.3f} ms incl. lock wait)")
+
+    print(f"target p95 <= {args.target_ms} ms: {'FAIL' if failed else 'ok'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Game objects shared by the engine (main.py) and the storage backends.
+
+The slotted PlayerState/RoomState are what the game logic and storage work
+with; the card catalog maps compact card ids to kinds, names, suits and values.
+Responses are built from them by the room views in main.py.
+"""
+from array import array
+from typing import Dict, List, Optional, Tuple
+import ast
+
+# Domain objects used by the game logic. They are plain slotted classes: hands are
+# arrays of card ids and card details live in the card tables below, so loading a
+# player does not build or validate anything.
+class PlayerState:
+    __slots__ = ("id", "room_id", "name", "hp", "max_hp", "hand", "role", "is_alive", "is_ready", "position",
+                 "weapon", "permanent_effects", "is_bot")
+
+    def __init__(self, id: int, room_id: int, name: str, hp: int = 4, max_hp: int = 5,
+                 hand: Optional[array] = None, role: Optional[str] = None, is_alive: bool = True,
+                 is_ready: bool = False, position: int = 0, weapon: str = "Кольт",
+                 permanent_effects: Optional[List[str]] = None, is_bot: bool = False):
+        self.id = id
+        self.room_id = room_id
+        self.name = name
+        self.hp = hp
+        self.max_hp = max_hp
+        self.hand = hand if hand is not None else array("H")  # card ids
+        self.role = role
+        self.is_alive = is_alive
+        self.is_ready = is_ready
+        self.position = position
+        self.weapon = weapon
+        self.permanent_effects = permanent_effects if permanent_effects is not None else []
+        self.is_bot = is_bot
+
+
+class RoomState:
+    __slots__ = ("id", "players", "game_started", "current_player_id", "roles_assigned", "seats", "winner",
+                 "started_at", "turn")
+
+    def __init__(self, id: int, players: Optional[Dict[int, PlayerState]] = None, game_started: bool = False,
+                 current_player_id: Optional[int] = None, roles_assigned: bool = False,
+                 seats: Optional[int] = None, winner: Optional[str] = None, started_at: Optional[float] = None,
+                 turn: int = 0):
+        self.id = id
+        self.players = players if players is not None else {}  # ordered by seat position
+        self.game_started = game_started
+        self.current_player_id = current_player_id
+        self.roles_assigned = roles_assigned
+        # Players seated in the room; players may hold only part of them
+        self.seats = seats if seats is not None else len(self.players)
+        self.winner = winner  # side that won once the game is over: "шериф", "бандиты" or "ренегат"
+        self.started_at = started_at  # unix time the game was dealt
+        self.turn = turn  # turns passed since the deal, see match_max_turns
+
+
+# Constants
+MAX_PLAYERS = 7
+
+WEAPONS = {
+    "Кольт": 1,
+    "Скофилд": 2,
+    "Ремингтон": 3,
+    "Карабин": 4,
+    "Винчестер": 5,
+    "Воканчик": 1,
+}
+
+# Cards of the deck: (name, suit, value, copies)
+CARD_DEFINITIONS: List[Tuple[str, Optional[str], Optional[int], int]] = [
+    *[(f"{value}_{suit}", suit, value, 1) for suit in ["черви", "бубны", "трефы", "пики"] for value in range(2, 11)],
+    ("Бэнг", None, None, 25),
+    ("Мимо", None, None, 15),
+    ("Пиво", None, None, 10),
+    ("Дилижанс", None, None, 2),
+    ("Уэллс Фарго", None, None, 2),
+    ("Магазин", None, None, 2),
+    ("Паника", None, None, 3),
+    ("Красотка", None, None, 3),
+    ("Гатлинг", None, None, 1),
+    ("Дуэль", None, None, 3),
+    ("Скофилд", None, None, 1),  # weapon
+    ("Бочка", "черви", None, 1),  # TODO
+    ("Тюрьма", None, None, 1),  # TODO
+    ("Динамит", None, None, 1),  # TODO
+    ("Мустанг", None, None, 1),  # TODO
+    ("Прицел", None, None, 1),  # TODO
+]
+
+# Every physical card has a small stable id. Piles and hands hold ids in
+# array("H") and compare kinds as integers; names are looked up for display only.
+# Ids follow CARD_DEFINITIONS, so new cards must be appended there.
+CARD_KIND_NAMES: List[str] = [name for name, _, _, _ in CARD_DEFINITIONS]  # kind -> name
+CARD_KIND_SUITS: List[Optional[str]] = [suit for _, suit, _, _ in CARD_DEFINITIONS]
+CARD_KIND_VALUES: List[Optional[int]] = [value for _, _, value, _ in CARD_DEFINITIONS]
+CARD_KINDS: Dict[str, int] = {name: kind for kind, name in enumerate(CARD_KIND_NAMES)}  # name -> kind
+CARD_KIND = array("B", [kind for kind, (_, _, _, copies) in enumerate(CARD_DEFINITIONS) for _ in range(copies)])
+CARD_NAMES: List[str] = [CARD_KIND_NAMES[kind] for kind in CARD_KIND]  # card id -> name
+
+BANG = CARD_KINDS["Бэнг"]
+MIMO = CARD_KINDS["Мимо"]
+
+
+def card_name(card_id: int) -> str:
+    return CARD_NAMES[card_id]
+
+
+def card_suit(card_id: int) -> Optional[str]:
+    return CARD_KIND_SUITS[CARD_KIND[card_id]]
+
+
+def card_value(card_id: int) -> Optional[int]:
+    return CARD_KIND_VALUES[CARD_KIND[card_id]]
+
+
+def find_card(hand: array, kind: int) -> Optional[int]:
+    """Id of the first card of the given kind in the hand, or None."""
+    for card_id in hand:
+        if CARD_KIND[card_id] == kind:
+            return card_id
+    return None
+
+
+def parse_permanent_effects(permanent_effects_str: str) -> List[str]:
+    try:
+        permanent_effects = ast.literal_eval(permanent_effects_str)
+    except (ValueError, SyntaxError):
+        return []
+    return permanent_effects if isinstance(permanent_effects, list) else []
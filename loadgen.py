@@ -0,0 +1,233 @@
+"""HTTP load generator that plays games against the API.
+
+Starts the server (uvicorn) on a throwaway database, unless --url points at a
+running one, and keeps --rooms rooms busy for --duration seconds. Every room runs
+in its own thread with one keep-alive connection: it creates itself, seats 4..7
+players, marks them ready, starts the game and plays turns. The current player
+plays cards from their hand, shoots the next living player when holding a Бэнг
+and passes; between actions players poll GET /room the way clients do. When a
+game is over or --turns turns are played the thread starts a new room.
+
+    python loadgen.py --rooms 50 --duration 60
+    python loadgen.py --url http://127.0.0.1:8000 --rooms 10
+
+Reports throughput and, per endpoint, p50/p95/p99 latency and response codes.
+Exits with status 1 when more than --max-error-rate of requests fail (5xx or
+no response): run it before shipping a persistence change.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from typing import Iterable
+
+# Cards the simulated players play on their turn, with whether they take a target
+PLAYABLE = {"Пиво": False, "Дилижанс": False, "Уэллс Фарго": False, "Магазин": False, "Гатлинг": False,
+            "Дуэль": True, "Паника": False, "Красотка": False, "Мустанг": False, "Прицел": False,
+            "Скофилд": False, "Бочка": False}
+
+
+def percentile(samples: Iterable[float], q: float) -> float:
+    """Nearest-rank q-quantile (0..1) of samples; replay.py and bench_start_game.py report these too."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Client:
+    """One keep-alive connection that records (endpoint, status, ms) of every request."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.samples = []
+
+    def request(self, method: str, path: str, endpoint: str, body=None):
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        started = time.perf_counter()
+        try:
+            self.conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            status, data = 0, b""
+        self.samples.append((endpoint, status, (time.perf_counter() - started) * 1000))
+        if 200 <= status < 300:
+            return json.loads(data)
+        return None
+
+
+def play_room(client: Client, room_id: int, rng: random.Random, args, deadline: float) -> bool:
+    """Play one game in room_id until it ends or the deadline passes; True when it was started."""
+    quoted = urllib.parse.quote
+    if client.request("POST", f"/create_room/{room_id}", "POST /create_room") is None:
+        return False
+    ids = []
+    for seat in range(rng.randint(4, 7)):
+        added = client.request("POST", f"/add_player/{room_id}/{quoted(f'p{seat}')}", "POST /add_player")
+        if added is None:
+            return False
+        ids.append(added["player_id"])
+    for player_id in ids:
+        client.request("POST", f"/ready/{room_id}/{player_id}", "POST /ready")
+    if client.request("POST", f"/start_game/{room_id}", "POST /start_game") is None:
+        return False
+
+    def act(action: str, card: str = None, target: int = None):
+        time.sleep(args.think)
+        body = {"player_id": current, "action": action, "card_name": card, "target_player_id": target}
+        client.request("POST", f"/player_action/{room_id}", f"POST /player_action {action}", body)
+        # Other players watch the table
+        for _ in range(args.polls):
+            client.request("GET", f"/room/{room_id}?player_id={rng.choice(ids)}", "GET /room")
+
+    for _ in range(args.turns):
+        if time.monotonic() >= deadline:
+            break
+        state = client.request("GET", f"/room/{room_id}?player_id={ids[0]}", "GET /room")
+        if state is None:
+            break
+        if state["winner"] is not None:
+            break
+        current = state["current_player"]
+        alive = [p["id"] for p in state["players"] if p["is_alive"]]
+        if len(alive) <= 1 or current not in alive:
+            break
+        view = client.request("GET", f"/room/{room_id}?player_id={current}", "GET /room")
+        if view is None:
+            break
+        me = next(p for p in view["players"] if p["id"] == current)
+        others = [player_id for player_id in alive if player_id != current]
+        neighbour = others[alive.index(current) % len(others)]  # next living seat
+        cards = [card for card in me["hand"] if card in PLAYABLE]
+        if cards:
+            card = rng.choice(cards)
+            act("play_card", card, rng.choice(others) if PLAYABLE[card] else None)
+        if "Бэнг" in me["hand"]:
+            act("shoot", target=neighbour)
+        act("pass")
+    return True
+
+
+def start_server(args):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ)
+    env["BANG_DATABASE_URL"] = os.path.join(tempfile.mkdtemp(prefix="bang-load-"), "load.db")
+    env["BANG_STORAGE"] = args.storage
+    if not args.limits:
+        for variable in ("BANG_PLAYER_ACTION_RATE", "BANG_ROOM_ACTION_RATE", "BANG_PLAYER_POLL_RATE",
+                         "BANG_ROOM_POLL_RATE"):
+            env[variable] = "0"
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"server exited with status {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return server, "127.0.0.1", port
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    sys.exit("server did not start in 30 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=20, help="rooms played concurrently")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--turns", type=int, default=200, help="turns per game before a new room is started")
+    parser.add_argument("--think", type=float, default=0.05, help="seconds a player waits before an action")
+    parser.add_argument("--polls", type=int, default=2, help="GET /room polls after every action")
+    parser.add_argument("--url", help="server to load instead of starting one")
+    parser.add_argument("--storage", default="sqlite", help="BANG_STORAGE of the started server")
+    parser.add_argument("--limits", action="store_true", help="keep the rate limits of the started server")
+    parser.add_argument("--first-room", type=int, default=1_000_000, help="id of the first room created")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        server, host, port = start_server(args)
+
+    room_ids = itertools.count(args.first_room)
+    room_ids_lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    clients = []
+    games = [0] * args.rooms
+
+    def run(index: int):
+        client = clients[index]
+        rng = random.Random(args.seed * 1_000_003 + index)
+        while time.monotonic() < deadline:
+            with room_ids_lock:
+                room_id = next(room_ids)
+            if play_room(client, room_id, rng, args, deadline):
+                games[index] += 1
+            else:
+                time.sleep(0.1)  # the server is refusing rooms; do not spin
+
+    try:
+        clients.extend(Client(host, port) for _ in range(args.rooms))
+        threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(args.rooms)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    by_endpoint = defaultdict(list)
+    for client in clients:
+        for endpoint, status, ms in client.samples:
+            by_endpoint[endpoint].append((status, ms))
+    total = sum(len(samples) for samples in by_endpoint.values())
+    failed = 0
+    print(f"{'endpoint':<32} {'count':>7} {'req/s':>7} {'2xx':>6} {'4xx':>6} {'429':>5} {'5xx':>5} {'fail':>5} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for endpoint in sorted(by_endpoint):
+        samples = by_endpoint[endpoint]
+        statuses = [status for status, _ in samples]
+        latencies = [ms for _, ms in samples]
+        ok = sum(200 <= status < 300 for status in statuses)
+        client_errors = sum(400 <= status < 500 for status in statuses)
+        limited = statuses.count(429)
+        server_errors = sum(status >= 500 for status in statuses)
+        no_response = statuses.count(0)
+        failed += server_errors + no_response
+        print(f"{endpoint:<32} {len(samples):>7} {len(samples) / elapsed:>7.1f} {ok:>6} {client_errors:>6} "
+              f"{limited:>5} {server_errors:>5} {no_response:>5} {percentile(latencies, 0.5):>7.2f} "
+              f"{percentile(latencies, 0.95):>7.2f} {percentile(latencies, 0.99):>7.2f}")
+    error_rate = failed / total if total else 1.0
+    print(f"{total} requests in {elapsed:.1f} s: {total / elapsed:.1f} req/s, {sum(games)} games started, "
+          f"error rate {error_rate:.2%}")
+    return 1 if error_rate > args.max_error_rate else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
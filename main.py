@@ -1,424 +1,481 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from array import array
+import asyncio
+import bisect
+import heapq
+import hmac
+import json
+import logging
+import os
 import random
-import sqlite3
-
-app = FastAPI()
-
-# Database setup
-DATABASE_URL = "game.db"  # SQLite database file
-conn = sqlite3.connect(DATABASE_URL, check_same_thread=False)
-cursor = conn.cursor()
-
-# Create tables (if they don't exist)
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS cards (
-    name TEXT PRIMARY KEY,
-    suit TEXT,
-    value INTEGER
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS players (
-    id INTEGER PRIMARY KEY,
-    name TEXT,
-    hp INTEGER DEFAULT 4,
-    max_hp INTEGER DEFAULT 5,
-    role TEXT,
-    is_alive INTEGER DEFAULT 1,  -- 1 for True, 0 for False
-    is_ready INTEGER DEFAULT 0,
-    position INTEGER DEFAULT 0,
-    weapon TEXT DEFAULT 'Кольт',
-    permanent_effects TEXT DEFAULT '[]'
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS game_rooms (
-    id INTEGER PRIMARY KEY,
-    game_started INTEGER DEFAULT 0,
-    current_player_id INTEGER,
-    roles_assigned INTEGER DEFAULT 0
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS player_hands (
-    player_id INTEGER,
-    card_name TEXT,
-    FOREIGN KEY (player_id) REFERENCES players(id),
-    FOREIGN KEY (card_name) REFERENCES cards(name),
-    PRIMARY KEY (player_id, card_name)
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS deck (
-    room_id INTEGER,
-    card_name TEXT,
-    position INTEGER,  -- Order in the deck
-    FOREIGN KEY (room_id) REFERENCES game_rooms(id),
-    FOREIGN KEY (card_name) REFERENCES cards(name),
-    PRIMARY KEY (room_id, card_name)
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS discard_pile (
-    room_id INTEGER,
-    card_name TEXT,
-    FOREIGN KEY (room_id) REFERENCES game_rooms(id),
-    FOREIGN KEY (card_name) REFERENCES cards(name),
-    PRIMARY KEY (room_id, card_name)
-)
-""")
-
-conn.commit()
-
-
-# Models (using Pydantic for API interaction, not directly for database)
-class Card(BaseModel):
-    name: str
-    suit: Optional[str] = None
-    value: Optional[int] = None
-
-
-class Player(BaseModel):
-    id: int
-    name: str
-    hp: int
-    max_hp: int
-    hand: List[Card]  # Updated type hint
-    role: Optional[str] = None
-    is_alive: bool
-    is_ready: bool
-    position: int
-    weapon: str
-    permanent_effects: List[str]  # Storing as list
-
-
-class GameRoom(BaseModel):
-    id: int
-    players: Dict[int, Player]  # Updated type hint
-    game_started: bool
-    current_player_id: Optional[int]
-    roles_assigned: bool
-
-
-# Constants
-WEAPONS = {
-    "Кольт": 1,
-    "Скофилд": 2,
-    "Ремингтон": 3,
-    "Карабин": 4,
-    "Винчестер": 5,
-    "Воканчик": 1,
-}
-
-
-# Database Helper Functions
-def db_get_card(card_name: str) -> Optional[Card]:
-    cursor.execute("SELECT name, suit, value FROM cards WHERE name = ?", (card_name,))
-    row = cursor.fetchone()
-    if row:
-        name, suit, value = row
-        return Card(name=name, suit=suit, value=value)
-    return None
-
-
-def db_add_card(card: Card):
+import threading
+import time
+
+from domain import (BANG, CARD_KIND, CARD_KINDS, MAX_PLAYERS, MIMO, WEAPONS, PlayerState, RoomState, card_name,
+                    card_suit, card_value, find_card)
+from profiling import MODES as PROFILE_MODES, ProfileSession, Profiler
+from ratelimit import RateLimiter, Rejected, WriteGate, parse_rate
+from stats import Deltas, GameStats, add_delta, hour_key
+from storage import MemoryStorage, SqliteStorage
+from timer_wheel import TimerWheel
+from tournament import Match, Tournament
+from tracing import Tracer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing touches the database at import time; see warm_up
+    warm_up()
+    start_turn_scheduler()
     try:
-        cursor.execute("INSERT INTO cards (name, suit, value) VALUES (?, ?, ?)",
-                       (card.name, card.suit, card.value))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        # Card already exists, you can handle this as needed (e.g., update)
-        pass
-
-
-def db_get_player(player_id: int) -> Optional[Player]:
-    cursor.execute(
-        "SELECT id, name, hp, max_hp, role, is_alive, is_ready, position, weapon, permanent_effects FROM players WHERE id = ?",
-        (player_id,))
-    row = cursor.fetchone()
-    if row:
-        id, name, hp, max_hp, role, is_alive, is_ready, position, weapon, permanent_effects_str = row
-        # Fetch hand cards
-        cursor.execute("SELECT card_name FROM player_hands WHERE player_id = ?", (id,))
-        card_names = [row[0] for row in cursor.fetchall()]
-        hand = [db_get_card(card_name) for card_name in card_names if db_get_card(card_name) is not None]
-
-        # Parse permanent_effects
+        yield
+    finally:
+        stop_turn_scheduler()
+        with db_lock:
+            storage.close()
+
+
+app = FastAPI(lifespan=lifespan)
+log = logging.getLogger(__name__)
+
+# Storage (see storage.py)
+STORAGE = os.environ.get("BANG_STORAGE", "sqlite")  # "sqlite" or "memory"
+DATABASE_URL = os.environ.get("BANG_DATABASE_URL", "game.db")  # SQLite database file
+READ_POOL_SIZE = int(os.environ.get("BANG_READ_POOL_SIZE", "4"))  # 0: reads share the writer connection
+RECORD_ACTIONS = os.environ.get("BANG_RECORD_ACTIONS", "0") == "1"  # keep action traces, see record_action
+
+# Spans of player actions (tracing.py), written only when BANG_TRACE_FILE is set. Traces
+# are kept at random with BANG_TRACE_SAMPLE, and always when slower than BANG_TRACE_SLOW_MS.
+TRACE_SLOW_MS = os.environ.get("BANG_TRACE_SLOW_MS")
+tracer = Tracer(os.environ.get("BANG_TRACE_FILE"), sample_rate=float(os.environ.get("BANG_TRACE_SAMPLE", "0.01")),
+                slow_ms=float(TRACE_SLOW_MS) if TRACE_SLOW_MS else None)
+
+if STORAGE == "sqlite":
+    storage = SqliteStorage(DATABASE_URL, READ_POOL_SIZE)
+elif STORAGE == "memory":
+    storage = MemoryStorage()
+else:
+    raise ValueError(f"BANG_STORAGE must be 'sqlite' or 'memory', not {STORAGE!r}")
+
+# Writes inside db_transaction() are committed once, when the outermost block exits
+db_lock = storage.lock
+_transaction_depth = 0
+_transaction_rooms = set()  # rooms whose in-memory piles the open transaction touched
+_transaction_deaths = set()  # rooms where a player died in the open transaction, see end_game_if_over
+_transaction_stats: Deltas = {}  # see count_stat
+_after_commit: Dict[Hashable, Callable[[], None]] = {}  # see db_on_commit
+
+
+@contextmanager
+def db_transaction():
+    global _transaction_depth
+    with db_lock:
+        _transaction_depth += 1
         try:
-            permanent_effects = eval(permanent_effects_str)  # Be cautious when using eval
-            if not isinstance(permanent_effects, list):
-                permanent_effects = []
-        except:
-            permanent_effects = []
-
-        return Player(id=id, name=name, hp=hp, max_hp=max_hp, hand=hand, role=role,
-                      is_alive=bool(is_alive), is_ready=bool(is_ready), position=position, weapon=weapon,
-                      permanent_effects=permanent_effects)
-    return None
+            yield storage
+            if _transaction_depth == 1:
+                settle_transaction()
+        except BaseException:
+            _transaction_depth -= 1
+            if _transaction_depth == 0:
+                storage.rollback()
+                # Cached piles may hold changes that were just rolled back
+                for room_id in _transaction_rooms:
+                    _room_piles.pop(room_id, None)
+                _transaction_rooms.clear()
+                _transaction_deaths.clear()
+                _transaction_stats.clear()
+                _after_commit.clear()
+            raise
+        _transaction_depth -= 1
+        if _transaction_depth == 0:
+            with tracer.span("commit"):
+                storage.commit()
+            _transaction_rooms.clear()
+            game_stats.merge(_transaction_stats)
+            _transaction_stats.clear()
+            callbacks = list(_after_commit.values())
+            _after_commit.clear()
+            for callback in callbacks:
+                callback()
+
+
+def settle_transaction():
+    """Last writes of the outermost transaction: ends of games, then the statistics."""
+    while _transaction_deaths:
+        end_game_if_over(_transaction_deaths.pop())
+    if _transaction_stats:
+        storage.add_stats(_transaction_stats)
+
+
+def db_on_commit(key: Hashable, callback: Callable[[], None]):
+    """Run callback once the open transaction commits (now if there is none).
+
+    Used for in-memory state that must not get ahead of the database; a later
+    callback with the same key replaces the earlier one.
+    """
+    if _transaction_depth:
+        _after_commit[key] = callback
+    else:
+        callback()
 
 
-def db_add_player(player: Player):
-    cursor.execute("""
-        INSERT INTO players (id, name, hp, max_hp, role, is_alive, is_ready, position, weapon, permanent_effects)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (player.id, player.name, player.hp, player.max_hp, player.role, int(player.is_alive), int(player.is_ready),
-          player.position, player.weapon, str(player.permanent_effects)))  # Store permanent_effects as string
-    conn.commit()
-
-
-def db_update_player(player: Player):
-    cursor.execute("""
-        UPDATE players SET name=?, hp=?, max_hp=?, role=?, is_alive=?, is_ready=?, position=?, weapon=?, permanent_effects=?
-        WHERE id=?
-    """, (
-    player.name, player.hp, player.max_hp, player.role, int(player.is_alive), int(player.is_ready), player.position,
-    player.weapon, str(player.permanent_effects), player.id))  # Store as string
-    conn.commit()
-
-
-def db_get_room(room_id: int) -> Optional[GameRoom]:
-    cursor.execute("SELECT id, game_started, current_player_id, roles_assigned FROM game_rooms WHERE id = ?",
-                   (room_id,))
-    row = cursor.fetchone()
-    if row:
-        id, game_started, current_player_id, roles_assigned = row
-        # Fetch players
-        cursor.execute(
-            "SELECT id FROM players WHERE id IN (SELECT player_id FROM player_hands WHERE player_id IN (SELECT id FROM players WHERE id IN (SELECT player_id FROM player_hands)))",
-            (id,))
-        player_ids = [row[0] for row in cursor.fetchall()]
-        players = {player_id: db_get_player(player_id) for player_id in player_ids if
-                   db_get_player(player_id) is not None}
-
-        return GameRoom(id=id, players=players, game_started=bool(game_started),
-                        current_player_id=current_player_id, roles_assigned=bool(roles_assigned))
-    return None
+def room_rng(room_id: int) -> random.Random:
+    """Generator for the next random decision of a room.
 
+    Every call advances the persisted step of the room, so the n-th decision
+    depends only on the room seed and n: a replay with the same seed shuffles and
+    steals the same cards, and a rolled back action leaves the step untouched.
+    """
+    seed, step = storage.next_rng_step(room_id)
+    return random.Random(f"{seed}:{step}")
 
-def db_add_room(room_id: int):
-    cursor.execute("INSERT INTO game_rooms (id, game_started, current_player_id, roles_assigned) VALUES (?, ?, ?, ?)",
-                   (room_id, 0, None, 0))
-    conn.commit()
 
-
-def db_update_room(room: GameRoom):
-    cursor.execute("""
-        UPDATE game_rooms SET game_started=?, current_player_id=?, roles_assigned=?
-        WHERE id=?
-    """, (int(room.game_started), room.current_player_id, int(room.roles_assigned), room.id))
-    conn.commit()
-
-
-def db_add_card_to_player_hand(player_id: int, card_name: str):
-    cursor.execute("INSERT INTO player_hands (player_id, card_name) VALUES (?, ?)",
-                   (player_id, card_name))
-    conn.commit()
-
-
-def db_remove_card_from_player_hand(player_id: int, card_name: str):
-    cursor.execute("DELETE FROM player_hands WHERE player_id=? AND card_name=?",
-                   (player_id, card_name))
-    conn.commit()
-
-
-def db_get_deck(room_id: int) -> List[Card]:
-    cursor.execute("SELECT card_name FROM deck WHERE room_id = ? ORDER BY position", (room_id,))
-    card_names = [row[0] for row in cursor.fetchall()]
-    return [db_get_card(card_name) for card_name in card_names if db_get_card(card_name) is not None]
-
-
-def db_add_card_to_deck(room_id: int, card_name: str, position: int):
-    cursor.execute("INSERT INTO deck (room_id, card_name, position) VALUES (?, ?, ?)",
-                   (room_id, card_name, position))
-    conn.commit()
-
-
-def db_remove_card_from_deck(room_id: int, card_name: str):
-    cursor.execute("DELETE FROM deck WHERE room_id=? AND card_name=?", (room_id, card_name))
-    conn.commit()
-
-
-def db_clear_deck(room_id: int):
-    cursor.execute("DELETE FROM deck WHERE room_id=?", (room_id,))
-    conn.commit()
-
-
-def db_get_discard_pile(room_id: int) -> List[Card]:
-    cursor.execute("SELECT card_name FROM discard_pile WHERE room_id = ?", (room_id,))
-    card_names = [row[0] for row in cursor.fetchall()]
-    return [db_get_card(card_name) for card_name in card_names if db_get_card(card_name) is not None]
-
-
-def db_add_card_to_discard_pile(room_id: int, card_name: str):
-    cursor.execute("INSERT INTO discard_pile (room_id, card_name) VALUES (?, ?)",
-                   (room_id, card_name))
-    conn.commit()
-
-
-def db_clear_discard_pile(room_id: int):
-    cursor.execute("DELETE FROM discard_pile WHERE room_id=?", (room_id,))
-    conn.commit()
-
-
-# Data initialization moved to database
-def create_deck():
-    suits = ["черви", "бубны", "трефы", "пики"]
-    values = list(range(2, 11))
-
-    deck = []
-
-    for suit in suits:
-        for value in values:
-            card = Card(name=f"{value}_{suit}", suit=suit, value=value)
-            db_add_card(card)  # Add to DB
-            deck.append(card.name)  # Append the card name
-    # Simplified code due the usage of DB
-    for _ in range(25):
-        db_add_card(Card(name="Бэнг"))
-        deck.append("Бэнг")
-    for _ in range(15):
-        db_add_card(Card(name="Мимо"))
-        deck.append("Мимо")
-    for _ in range(10):
-        db_add_card(Card(name="Пиво"))
-        deck.append("Пиво")
-    for _ in range(2):
-        db_add_card(Card(name="Дилижанс"))
-        deck.append("Дилижанс")
-    for _ in range(2):
-        db_add_card(Card(name="Уэллс Фарго"))
-        deck.append("Уэллс Фарго")
-    for _ in range(2):
-        db_add_card(Card(name="Магазин"))
-        deck.append("Магазин")
-    for _ in range(3):
-        db_add_card(Card(name="Паника"))
-        deck.append("Паника")
-    for _ in range(3):
-        db_add_card(Card(name="Красотка"))
-        deck.append("Красотка")
-    for _ in range(1):
-        db_add_card(Card(name="Гатлинг"))
-        deck.append("Гатлинг")
-    for _ in range(3):
-        db_add_card(Card(name="Дуэль"))
-        deck.append("Дуэль")
-
-    db_add_card(Card(name="Скофилд"))  # weapon
-    deck.append("Скофилд")
-    db_add_card(Card(name="Бочка", suit="черви", value=None))  # TODO
-    deck.append("Бочка")
-    db_add_card(Card(name="Тюрьма"))  # TODO
-    deck.append("Тюрьма")
-    db_add_card(Card(name="Динамит"))  # TODO
-    deck.append("Динамит")
-    db_add_card(Card(name="Мустанг"))  # TODO
-    deck.append("Мустанг")
-    db_add_card(Card(name="Прицел"))  # TODO
-    deck.append("Прицел")
-
-    random.shuffle(deck)
-    return deck
+def db_setup_game(room: RoomState, deck: array):
+    """Persist a freshly dealt game (roles, hands, deck, first player) in one transaction."""
+    with db_transaction():
+        storage.setup_game(room, deck)
+        _transaction_rooms.add(room.id)
+        _room_piles[room.id] = RoomPiles(deck, array("H"))
 
 
-# API endpoints
-@app.post("/create_room/{room_id}")
-def create_room(room_id: int):
-    if db_get_room(room_id):
-        raise HTTPException(status_code=400, detail="Комната уже существует")
+# Deck and discard pile of every room are kept in memory once loaded; the top of
+# either pile is the end of its array, so drawing and discarding are O(1)
+# and each of them writes a single row. The database rows mirror the arrays by position.
+class RoomPiles:
+    __slots__ = ("deck", "discard")
 
-    db_add_room(room_id)
-    return {"message": f"Комната {room_id} создана"}
+    def __init__(self, deck: array, discard: array):
+        self.deck = deck
+        self.discard = discard
 
 
-@app.post("/add_player/{room_id}/{player_name}")
-def add_player(room_id: int, player_name: str):
-    room = db_get_room(room_id)
-    if not room:
-        raise HTTPException(status_code=404, detail="Комната не найдена")
+_room_piles: Dict[int, RoomPiles] = {}
 
-    new_id = len(room.players) + 1
-    position = new_id - 1
 
-    player = Player(id=new_id, name=player_name, hp=4, max_hp=5, hand=[], role=None, is_alive=True, is_ready=False,
-                    position=position, weapon="Кольт", permanent_effects=[])  # Removed hand assignment
-    db_add_player(player)
+def get_piles(room_id: int) -> RoomPiles:
+    piles = _room_piles.get(room_id)
+    if piles is None:
+        with db_lock:
+            piles = _room_piles.get(room_id)
+            if piles is None:
+                piles = RoomPiles(storage.get_deck(room_id), storage.get_discard(room_id))
+                _room_piles[room_id] = piles
+    return piles
 
-    # Update the player within the room.  This is necessary to reflect the changes.
-    room = db_get_room(room_id)  # Re-fetch the room
 
-    return {"message": f"Игрок {player_name} добавлен в комнату {room_id}"}
+def create_deck(rng: random.Random) -> array:
+    deck = array("H", range(len(CARD_KIND)))
+    rng.shuffle(deck)
+    return deck
 
 
-@app.post("/ready/{room_id}/{player_id}")
-def set_ready(room_id: int, player_id: int):
-    player = db_get_player(player_id)
-    if not player:
-        raise HTTPException(status_code=404, detail="Игрок не найден")
+# Room versions and long polling
+# Every mutation of a room bumps its version (room_changed). Long-poll requests
+# park on one asyncio.Event per room, so thousands of waiters cost one dict entry
+# and one wake-up per change; the event goes away with its last waiter. Versions
+# come from one counter shared by all rooms, so a deleted and recreated room never
+# repeats a version. They live in memory only; a client holding a version from
+# before a restart just gets an immediate answer.
+LONG_POLL_TIMEOUT = 25.0  # default seconds a wait request is held open
+LONG_POLL_MAX_TIMEOUT = 60.0
+
+
+class RoomWatchers:
+    def __init__(self):
+        self._versions: Dict[int, int] = {}
+        self._last_version = 0
+        self._events: Dict[int, asyncio.Event] = {}  # only touched on the event loop
+        self._waiters: Dict[int, int] = {}  # room id -> requests waiting, event loop only
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def version(self, room_id: int) -> int:
+        return self._versions.get(room_id, 0)
+
+    def bump(self, room_id: int) -> int:
+        """Record a change of the room and wake its waiters. Safe from any thread."""
+        with self._lock:
+            self._last_version += 1
+            version = self._versions[room_id] = self._last_version
+        if self._loop is not None and room_id in self._events:
+            self._loop.call_soon_threadsafe(self._wake, room_id)
+        return version
+
+    def _wake(self, room_id: int):
+        event = self._events.pop(room_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, room_id: int, since: int, timeout: float) -> int:
+        """Wait until the room version differs from since or timeout expires; returns the version."""
+        self._loop = asyncio.get_running_loop()
+        event = self._events.get(room_id)
+        if event is None:
+            event = self._events[room_id] = asyncio.Event()
+        self._waiters[room_id] = self._waiters.get(room_id, 0) + 1
+        try:
+            # Checked after registering, so a concurrent bump either shows here or wakes the event
+            if self.version(room_id) == since:
+                await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.pop(room_id) - 1
+            if waiters:
+                self._waiters[room_id] = waiters
+            elif self._events.get(room_id) is event:
+                del self._events[room_id]
+        return self.version(room_id)
+
+    def forget(self, room_id: int):
+        """Drop the version of a deleted room; its waiters were woken by the last bump."""
+        with self._lock:
+            self._versions.pop(room_id, None)
+
+
+room_watchers = RoomWatchers()
+
+
+def room_changed(room_id: int):
+    # Waiters must not read before the commit
+    db_on_commit(("changed", room_id), lambda: room_watchers.bump(room_id))
+
+
+# Lobby
+# Rooms that have not started and still have a free seat, bucketed by player count.
+# Every bucket is a sorted list of room ids, so a page of rooms with at least N
+# free seats is a bisect plus a merge of at most MAX_PLAYERS buckets.
+class OpenRoomIndex:
+    def __init__(self):
+        self._counts: Dict[int, int] = {}  # room id -> players
+        self._buckets: List[List[int]] = [[] for _ in range(MAX_PLAYERS)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _discard(self, room_id: int):
+        count = self._counts.pop(room_id, None)
+        if count is not None:
+            bucket = self._buckets[count]
+            del bucket[bisect.bisect_left(bucket, room_id)]
+
+    def update(self, room_id: int, players: int, game_started: bool):
+        with self._lock:
+            self._discard(room_id)
+            if not game_started and players < MAX_PLAYERS:
+                self._counts[room_id] = players
+                bisect.insort(self._buckets[players], room_id)
+
+    def remove(self, room_id: int):
+        with self._lock:
+            self._discard(room_id)
+
+    def page(self, min_free_seats: int, after: Optional[int], limit: int) -> List[Tuple[int, int]]:
+        """Up to limit (room id, players) pairs with id > after, in id order."""
+        max_players = MAX_PLAYERS - max(min_free_seats, 1)
+        with self._lock:
+            slices = []
+            for count in range(max_players + 1):
+                bucket = self._buckets[count]
+                start = bisect.bisect_right(bucket, after) if after is not None else 0
+                slices.append([(room_id, count) for room_id in bucket[start:start + limit]])
+        return list(heapq.merge(*slices))[:limit]
+
+
+open_rooms = OpenRoomIndex()
+
+
+def lobby_changed(room: RoomState):
+    db_on_commit(("lobby", room.id), lambda: open_rooms.update(room.id, len(room.players), room.game_started))
+
+
+# Admission control (ratelimit.py)
+# Requests are turned away before any storage work: 429 when a player or a room
+# is over its rate, 503 when too many writes are already waiting. Rates are
+# RATE/BURST per second, 0 turns a limit off. Writes serialize on db_lock anyway;
+# the gate keeps them from tying up every worker thread while they wait for it.
+# Handlers are sync, so a queued write still holds a worker thread: writers and
+# their queue are kept to a fraction of the threadpool, the rest is left to reads.
+THREADPOOL_SIZE = 40  # anyio's default number of worker threads
+def rate_limiter(name: str, variable: str, default: str) -> Optional[RateLimiter]:
+    rate = parse_rate(os.environ.get(variable, default))
+    return RateLimiter(name, *rate) if rate else None
+
+
+rate_limiters = {limiter.name: limiter for limiter in (
+    rate_limiter("player_actions", "BANG_PLAYER_ACTION_RATE", "10/20"),
+    rate_limiter("room_actions", "BANG_ROOM_ACTION_RATE", "50/100"),
+    rate_limiter("player_polls", "BANG_PLAYER_POLL_RATE", "20/40"),
+    rate_limiter("room_polls", "BANG_ROOM_POLL_RATE", "500/1000"),
+) if limiter}
+write_gate = WriteGate(int(os.environ.get("BANG_MAX_WRITERS", "4")),
+                       int(os.environ.get("BANG_MAX_WRITE_QUEUE", "8")))
+if write_gate.limit + write_gate.max_queue > THREADPOOL_SIZE // 2:
+    log.warning("BANG_MAX_WRITERS + BANG_MAX_WRITE_QUEUE = %s leaves reads less than half of %s threads",
+                write_gate.limit + write_gate.max_queue, THREADPOOL_SIZE)
+
+
+def admit(**keys: Optional[Hashable]):
+    """Take a token from every named limiter for its key (None: no key) or answer 429."""
+    try:
+        for name, key in keys.items():
+            limiter = rate_limiters.get(name)
+            if limiter is not None and key is not None:
+                limiter.acquire(key)
+    except Rejected as e:
+        raise HTTPException(status_code=429, detail="Слишком много запросов",
+                            headers={"Retry-After": e.retry_after_header})
 
-    player.is_ready = True
-    db_update_player(player)
-    return {"message": f"Игрок {player_id} готов"}
 
+@contextmanager
+def write_slot():
+    try:
+        write_gate.acquire()
+    except Rejected as e:
+        raise HTTPException(status_code=503, detail="Сервер перегружен", headers={"Retry-After": e.retry_after_header})
+    try:
+        yield
+    finally:
+        write_gate.release()
 
-@app.post("/start_game/{room_id}")
-def start_game(room_id: int):
-    room = db_get_room(room_id)
-    if not room:
-        raise HTTPException(status_code=404, detail="Комната не найдена")
-    players = {p_id: db_get_player(p_id) for p_id in room.players}
 
-    if len(players) < 4:
-        raise HTTPException(status_code=400, detail="Недостаточно игроков для начала игры")
-    if any(not p.is_ready for p in players.values()):
-        raise HTTPException(status_code=400, detail="Не все игроки готовы")
+@app.get("/admin/admission")
+def get_admission_stats(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    return {"rate_limits": {name: limiter.stats() for name, limiter in rate_limiters.items()},
+            "write_gate": write_gate.stats()}
 
-    num_players = len(players)
 
-    if num_players not in [4, 5, 6, 7]:
-        raise HTTPException(
-            status_code=400, detail="Поддерживаются только игры от 4 до 7 игроков"
-        )
+# API endpoints
+@app.post("/create_room/{room_id}")
+def create_room(room_id: int, seed: Optional[int] = None, x_admin_token: Optional[str] = Header(None)):
+    """Create a room; games with the same seed and actions play out the same way.
+
+    The seed decides every role and hand, so only admins may choose it.
+    """
+    if seed is not None:
+        check_admin(x_admin_token)
+    with write_slot(), profiler.capture("create_room"):
+        return open_room(room_id, seed)
+
+
+def open_room(room_id: int, seed: Optional[int] = None):
+    """create_room without the checks, for replay.py and tests that pick the seed."""
+    with db_transaction():
+        if storage.get_room(room_id):
+            raise HTTPException(status_code=400, detail="Комната уже существует")
+
+        storage.add_room(room_id, seed if seed is not None else random.getrandbits(63))
+        touch_room(room_id)
+        room_changed(room_id)
+        lobby_changed(RoomState(room_id))
+    return {"message": f"Комната {room_id} создана"}
 
-    roles = assign_roles(num_players)
 
-    player_list = list(players.values())
-    for i, role in enumerate(roles):
-        player = player_list[i]
-        player.role = role
-        db_update_player(player)
+@app.post("/add_player/{room_id}/{player_name}")
+def add_player(room_id: int, player_name: str, bot: bool = False):
+    """Seat a player; with bot=true the server plays the seat and it is ready at once."""
+    with write_slot(), profiler.capture("add_player"), db_transaction():
+        room = storage.get_room(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Комната не найдена")
+        if room.game_started:
+            raise HTTPException(status_code=400, detail="Игра уже началась")
+        if len(room.players) >= MAX_PLAYERS:
+            raise HTTPException(status_code=400, detail="Комната заполнена")
+
+        player = PlayerState(id=None, room_id=room_id, name=player_name, position=len(room.players), is_ready=bot,
+                             is_bot=bot)
+        storage.add_player(player)
+        room.players[player.id] = player
+        touch_room(room_id)
+        room_changed(room_id)
+        lobby_changed(room)
+
+    return {"message": f"Игрок {player_name} добавлен в комнату {room_id}", "player_id": player.id}
+
+
+@app.post("/ready/{room_id}/{player_id}")
+def set_ready(room_id: int, player_id: int):
+    with write_slot(), profiler.capture("set_ready"), db_transaction():
+        player = storage.get_player(player_id)
+        if not player or player.room_id != room_id:
+            raise HTTPException(status_code=404, detail="Игрок не найден")
+
+        player.is_ready = True
+        storage.update_player(player)
+        touch_room(room_id)
+        room_changed(room_id)
+    return {"message": f"Игрок {player_id} готов"}
 
-    deck = create_deck()
-    db_clear_deck(room_id)  # clear the deck
-    # Initialize the deck in the database
-    for i, card_name in enumerate(deck):
-        db_add_card_to_deck(room_id, card_name, i)
 
-    # Раздача карт (по 4 карты каждому игроку)
+@app.post("/start_game/{room_id}")
+def start_game(room_id: int):
+    # Reads, checks and the bulk setup share one transaction: of concurrent starts one deals, the rest see it started
+    with write_slot(), profiler.capture("start_game"), db_transaction():
+        room = storage.get_room(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Комната не найдена")
+        if room.game_started:
+            raise HTTPException(status_code=400, detail="Игра уже началась")
+        players = room.players
+
+        if len(players) < 4:
+            raise HTTPException(status_code=400, detail="Недостаточно игроков для начала игры")
+        if any(not p.is_ready for p in players.values()):
+            raise HTTPException(status_code=400, detail="Не все игроки готовы")
+
+        num_players = len(players)
+
+        if num_players not in [4, 5, 6, 7]:
+            raise HTTPException(
+                status_code=400, detail="Поддерживаются только игры от 4 до 7 игроков"
+            )
+
+        deal_game(room)
+
+        return {"message": "Игра началась", "players": [
+            {"id": p.id, "name": p.name, "role": p.role} for p in players.values()
+        ]}
+
+
+def deal_game(room: RoomState):
+    """Assign roles, deal the hands and give the turn to the first player of a checked room."""
+    players = room.players
+    rng = room_rng(room.id)
+    roles = assign_roles(len(players), rng)
+    for player, role in zip(players.values(), roles):
+        player.role = role
+
+    # Раздача карт (по 4 карты каждому игроку) straight from the shuffled deck
+    deck = create_deck(rng)
     for player in players.values():
-        # Clear player hands
-        clear_player_hand(player)  # clear hand
-        draw_cards(player, room, 4)
+        player.hand = array("H", [deck.pop() for _ in range(4)])
 
     room.game_started = True
+    room.roles_assigned = True
     room.current_player_id = next(iter(players.keys()))  # Первый игрок
-    db_update_room(room)
-
-    return {"message": "Игра началась", "players": [
-        {"id": p.id, "name": p.name, "role": p.role} for p in players.values()
-    ]}
+    room.started_at = time.time()
+    db_setup_game(room, deck)  # one batch of writes
+    count_stat("games", "started")
+    count_stat("started", hour_key(room.started_at))
+    arm_turn_timer(room)
+    if players[room.current_player_id].is_bot:
+        queue_bot_turn(room.id)
+    touch_room(room.id)
+    room_changed(room.id)
+    lobby_changed(room)
 
 
 # Helper Functions
 
-def assign_roles(num_players: int) -> List[str]:
+def assign_roles(num_players: int, rng: random.Random) -> List[str]:
     """Assign roles for a game based on the number of players."""
     if num_players == 4:
         roles = ["шериф", "бандит", "бандит", "ренегат"]
@@ -430,53 +487,45 @@ def assign_roles(num_players: int) -> List[str]:
         roles = ["шериф", "помощник", "помощник", "бандит", "бандит", "ренегат", "ренегат"]
     else:
         raise ValueError("Unsupported number of players")
-    random.shuffle(roles)
+    rng.shuffle(roles)
     return roles
 
 
-def draw_cards(player: Player, room: GameRoom, num: int):
+def draw_cards(player: PlayerState, room: RoomState, num: int):
     """Draw a specified number of cards from the deck and add them to the player's hand."""
     for _ in range(num):
-        card = draw_card(room)  # Use the draw_card() function from database
-
-        if card:
-            player.hand.append(card)
-            db_update_player(player)  # update player
-
-        else:
-            reshuffle_discard_pile(room)
-
-            card = draw_card(room)
-            if card:
-                player.hand.append(card)
-                db_update_player(player)
-            else:
-                return
-
-
-def clear_player_hand(player: Player):
-    cursor.execute("DELETE FROM player_hands WHERE player_id=?", (player.id,))
-    conn.commit()
+        card = draw_card(room)  # reshuffles the discard pile when the deck is empty
+        if card is None:
+            return
+        player.hand.append(card)
+        storage.add_to_hand(player.id, card)
 
 
-def reshuffle_discard_pile(room: GameRoom):
+def reshuffle_discard_pile(room: RoomState):
     """Reshuffle discard pile into the deck"""
-    discard_pile = db_get_discard_pile(room.id)
-    if discard_pile:
-        random.shuffle(discard_pile)
+    with db_transaction():
+        piles = get_piles(room.id)
+        _transaction_rooms.add(room.id)
+        if piles.discard and not piles.deck:
+            # Swap the buffers: the (empty) deck list becomes the new discard pile
+            piles.deck, piles.discard = piles.discard, piles.deck
+            room_rng(room.id).shuffle(piles.deck)
+            storage.replace_piles(room.id, piles.deck, piles.discard)
 
-        db_clear_deck(room.id)  # Clear existing deck
-        db_clear_discard_pile(room.id)  # Clear discard pile
 
-        for i, card in enumerate(discard_pile):
-            db_add_card_to_deck(room.id, card.name, i)  # Add to the new deck
+def discard_card(room: RoomState, card_id: int):
+    with db_transaction():
+        _transaction_rooms.add(room.id)
+        discard = get_piles(room.id).discard
+        discard.append(card_id)
+        storage.append_discard(room.id, len(discard) - 1, [card_id])
 
 
 # Gameplay actions
 class PlayerAction(BaseModel):
     player_id: int
     action: str  # "play_card", "pass", "shoot", "use_card"
-    card_name: str = None
+    card_name: Optional[str] = None
     target_player_id: Optional[int] = None
 
 
@@ -485,102 +534,351 @@ async def root():
     return {"message": "Hello World"}
 
 
+# Read coalescing
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of the function."""
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "SingleFlight._Call"] = {}
+        self._lock = threading.Lock()
+        self.executed = 0  # calls that ran the function
+        self.shared = 0  # calls that got the result of another call
+
+    def do(self, key: Hashable, fn: Callable[[], object]):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# Room views
+# A room is projected once per version into a RoomView: the public state every
+# viewer shares (hands reduced to counts, roles hidden except the sheriff's) and
+# a small private part per player (own hand and role). A response is the public
+# state with the viewer's private part merged into their entry. Private parts of
+# players whose hand and role did not change are carried over from the last view.
+class RoomView:
+    __slots__ = ("version", "public", "seats", "private")
+
+    def __init__(self, version: int, public: dict, seats: Dict[int, int], private: Dict[int, Tuple[tuple, dict]]):
+        self.version = version
+        self.public = public
+        self.seats = seats  # player id -> index in public["players"]
+        self.private = private  # player id -> (hand and role it was built from, private fields)
+
+    def project(self, player_id: Optional[int]) -> dict:
+        seat = self.seats.get(player_id)
+        if seat is None:
+            return self.public
+        players = list(self.public["players"])
+        players[seat] = {**players[seat], **self.private[player_id][1]}
+        return {**self.public, "players": players}
+
+
+room_reads = SingleFlight()
+_room_views: Dict[int, RoomView] = {}
+_room_views_lock = threading.Lock()
+
+
 @app.get("/room/{room_id}")
-def get_room_state(room_id: int):
-    room = db_get_room(room_id)
+def get_room_state(room_id: int, player_id: Optional[int] = None):
+    """The room as player_id sees it: other players' hands are only counted."""
+    admit(room_polls=room_id, player_polls=player_id)
+    return read_room_state(room_id, player_id)
+
+
+def read_room_state(room_id: int, player_id: Optional[int]):
+    # Polls of a room that arrive while its view is being built share that build.
+    # The key includes the version, so a poll that arrives after a change never
+    # gets a view built before it.
+    with profiler.capture("get_room_state"):
+        version = room_watchers.version(room_id)
+        view = _room_views.get(room_id)
+        if view is None or view.version != version:
+            view = room_reads.do(("room", room_id, version), lambda: build_room_view(room_id, version))
+        if view is None:
+            return {"error": "Комната не найдена"}
+        # A watched room is not abandoned. Reads run outside of transactions, so the
+        # timer is armed directly rather than through touch_room
+        timers.arm(("idle", room_id), ROOM_IDLE_TIMEOUT)
+        return view.project(player_id)
+
+
+def build_room_view(room_id: int, version: int) -> Optional[RoomView]:
+    # Committed state only; see the snapshot() of the storage backend for whether it waits for a writer
+    with storage.snapshot() as snapshot:
+        room = snapshot.get_room(room_id)
+        if room:
+            # From the snapshot, not the pile cache: the writer changes that mid-transaction
+            deck_count = snapshot.count_deck(room_id)
     if not room:
-        return {"error": "Комната не найдена"}
+        _room_views.pop(room_id, None)
+        return None
 
+    previous = _room_views.get(room_id)
     players_info = []
-
-    players = {p_id: db_get_player(p_id) for p_id in room.players}
-
-    for p in players.values():
+    seats: Dict[int, int] = {}
+    private: Dict[int, Tuple[tuple, dict]] = {}
+    for state in room.players.values():
+        seats[state.id] = len(players_info)
         players_info.append(
             {
-                "id": p.id,
-                "name": p.name,
-                "hp": p.hp,
-                "max_hp": p.max_hp,
-                "hand": [card.name for card in p.hand],
-                "role": p.role if p.role == "шериф" else None,
-                "is_alive": p.is_alive,
-                "is_ready": p.is_ready,
-                "weapon": p.weapon,
-                "permanent_effects": p.permanent_effects,
+                "id": state.id,
+                "name": state.name,
+                "hp": state.hp,
+                "max_hp": state.max_hp,
+                "hand_count": len(state.hand),
+                "role": state.role if state.role == "шериф" else None,
+                "is_alive": state.is_alive,
+                "is_ready": state.is_ready,
+                "weapon": state.weapon,
+                "permanent_effects": list(state.permanent_effects),
+                "is_bot": state.is_bot,
             }
         )
+        source = (state.hand.tobytes(), state.role)
+        kept = previous.private.get(state.id) if previous else None
+        if kept is None or kept[0] != source:
+            kept = (source, {"hand": [card_name(card_id) for card_id in state.hand], "role": state.role})
+        private[state.id] = kept
 
-    deck = db_get_deck(room_id)
-
-    return {
+    view = RoomView(version, {
         "players": players_info,
         "game_started": room.game_started,
         "current_player": room.current_player_id,
-        "deck_count": len(deck),
+        "winner": room.winner,
+        "deck_count": deck_count,
+        "version": version,
+    }, seats, private)
+    with _room_views_lock:
+        current = _room_views.get(room_id)
+        if current is None or current.version <= version:
+            _room_views[room_id] = view
+    return view
+
+
+@app.get("/rooms")
+def list_rooms(open: bool = True, min_free_seats: int = 1, cursor: Optional[int] = None, limit: int = 50):
+    """Joinable rooms in id order; pass next_cursor back as cursor for the next page."""
+    if not open:
+        raise HTTPException(status_code=400, detail="Поддерживается только список открытых комнат")
+    limit = min(max(limit, 1), 500)
+    rooms = open_rooms.page(min_free_seats, cursor, limit)
+    return {
+        "rooms": [{"id": room_id, "players": players, "free_seats": MAX_PLAYERS - players}
+                  for room_id, players in rooms],
+        "next_cursor": rooms[-1][0] if len(rooms) == limit else None,
     }
 
 
-@app.post("/player_action/{room_id}")
-def player_action(room_id: int, action_data: PlayerAction):
-    room = db_get_room(room_id)
+@app.get("/room/{room_id}/wait")
+async def wait_room_state(room_id: int, since: int = 0, timeout: float = LONG_POLL_TIMEOUT,
+                          player_id: Optional[int] = None):
+    """Long poll: answer once the room version differs from since, or after timeout seconds."""
+    admit(room_polls=room_id, player_polls=player_id)
+    timeout = min(max(timeout, 0.0), LONG_POLL_MAX_TIMEOUT)
+    await room_watchers.wait(room_id, since, timeout)
+    return await run_in_threadpool(read_room_state, room_id, player_id)
 
-    if not room or not room.game_started:
-        raise HTTPException(status_code=400, detail="Игра не началась или комната не найдена")
 
-    player = get_player_by_id(room, action_data.player_id)
-
-    if not player or not player.is_alive:
-        raise HTTPException(status_code=404, detail="Игрок не найден или мертв")
-
-    current_player = get_current_player(room)
-
-    if current_player.id != player.id:
-        raise HTTPException(status_code=403, detail="Не ваш ход")
+@app.post("/player_action/{room_id}")
+def player_action(room_id: int, action_data: PlayerAction):
+    admit(room_actions=room_id, player_actions=action_data.player_id)
+    # Actions are applied one at a time (also against the turn scheduler), each as
+    # one transaction, so readers never see half of an action
+    with write_slot(), tracer.trace("player_action", **{"room.id": room_id, "action": action_data.action,
+                                                        "card": action_data.card_name}), \
+            profiler.capture("player_action", action_data.action, action_data.card_name), db_transaction():
+        result = apply_action(room_id, action_data)
+        touch_room(room_id)
+        room_changed(room_id)
+    return result
+
+
+def apply_action(room_id: int, action_data: PlayerAction):
+    """Validate and apply one player action."""
+    action = action_data.action
+    player_id, target_id = action_data.player_id, action_data.target_player_id
+
+    # Load only the players the action needs: passing looks for the next living
+    # player, shooting needs the target, a card declares its needs
+    effect = None
+    kind = None
+    player_ids: Optional[List[int]] = None  # None: every player
+    if action == "play_card":
+        kind = CARD_KINDS.get(action_data.card_name)
+        effect = CARD_EFFECTS.get(kind)
+        if effect is None or not effect.needs_players:
+            player_ids = [player_id]
+            if effect is not None and effect.needs_target and target_id is not None:
+                player_ids.append(target_id)
+    elif action == "shoot":
+        player_ids = [player_id] if target_id is None else [player_id, target_id]
+    with tracer.span("load", players=len(player_ids) if player_ids is not None else None):
+        room = storage.get_room(room_id, player_ids=player_ids)
+    hp_before = {p.id: p.hp for p in room.players.values()} if room else {}
+
+    with tracer.span("validate"):
+        if not room or not room.game_started:
+            raise HTTPException(status_code=400, detail="Игра не началась или комната не найдена")
+
+        player = room.players.get(player_id)
+
+        if room.winner is not None:
+            raise HTTPException(status_code=400, detail="Игра окончена")
+
+        if not player or not player.is_alive:
+            raise HTTPException(status_code=404, detail="Игрок не найден или мертв")
+
+        if room.current_player_id != player.id:
+            raise HTTPException(status_code=403, detail="Не ваш ход")
 
     try:
-        if action_data.action == "play_card":
-            return handle_play_card(room, player, action_data.card_name, action_data.target_player_id)
-        elif action_data.action == "pass":
-            pass_turn(room)
-            return {"status": "ход передан"}
-        elif action_data.action == "shoot":
-            return handle_shoot(room, player, action_data.target_player_id)
-        else:
-            raise HTTPException(status_code=400, detail="Неизвестное действие")
+        with tracer.span("effect"):
+            if action == "play_card":
+                card = find_card(player.hand, kind) if kind is not None else None
+                if card is None:
+                    raise HTTPException(status_code=400, detail="Карта не найдена в руке")
+                target = None
+                if effect is not None and effect.needs_target:
+                    if target_id is None:
+                        raise HTTPException(status_code=400, detail="Не указан целевой игрок")
+                    target = get_player_by_id(room, target_id)
+                result = play_card(EffectContext(room, player, target, card), effect)
+            elif action == "pass":
+                pass_turn(room)
+                result = {"status": "ход передан"}
+            elif action == "shoot":
+                result = handle_shoot(room, player, target_id)
+            else:
+                raise HTTPException(status_code=400, detail="Неизвестное действие")
 
     except HTTPException as e:
         raise e  # re-raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    record_action(room_id, action_data, result)
+    count_action(room, action_data, hp_before)
+    return result
 
-# Helper Functions
-def get_player_by_id(room: GameRoom, player_id: int) -> Player:
-    player = db_get_player(player_id)
-    if not player:
-        raise HTTPException(status_code=404, detail="Игрок не найден")
-    return player
+
+# Action traces
+# With BANG_RECORD_ACTIONS=1 every applied action (by players, bots or turn
+# timeouts) is stored with its result in the action's own transaction, so failed
+# actions leave no trace. GET /room/{id}/trace exports a room for replay.py; it is
+# an admin route, since the seed it returns gives away every hand.
+def record_action(room_id: int, action_data: PlayerAction, result: dict):
+    if RECORD_ACTIONS:
+        storage.record_action(room_id, action_data.player_id, action_data.action, action_data.card_name,
+                              action_data.target_player_id, json.dumps(result, ensure_ascii=False))
+
+
+@app.get("/room/{room_id}/trace")
+def get_room_trace(room_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Seed, seats and recorded actions of a room, in the format replay.py reads.
+
+    Admins only: the seed reveals every hidden role and hand of the room.
+    """
+    check_admin(x_admin_token)
+    with storage.snapshot() as snapshot:
+        trace = snapshot.get_trace(room_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Комната не найдена")
+    seed, seats, actions = trace
+    return {
+        "room_id": room_id,
+        "seed": seed,
+        "players": [{"id": id, "name": name, "is_bot": is_bot} for id, name, is_bot in seats],
+        "actions": [{"player_id": player_id, "action": action, "card_name": card_name,
+                     "target_player_id": target_player_id, "result": json.loads(result)}
+                    for player_id, action, card_name, target_player_id, result in actions],
+    }
+
+
+# Statistics (see stats.py)
+# Counters change with the action or the game end that moves them: count_stat
+# collects the deltas of a transaction, which writes them with its last statement
+# and merges them into game_stats once committed. Every recorded action is counted,
+# passes forced by a turn timeout included. GET /stats reads only memory.
+game_stats = GameStats(int(os.environ.get("BANG_STATS_WINDOW_HOURS", "24")))
+
+
+def count_stat(metric: str, key: str, count: int = 1, total: float = 0.0):
+    """Add to a counter as part of the open db_transaction()."""
+    add_delta(_transaction_stats, metric, key, count, total)
 
 
-def get_current_player(room: GameRoom) -> Player:
-    player = db_get_player(room.current_player_id)
+def count_action(room: RoomState, action_data: PlayerAction, hp_before: Dict[int, int]):
+    # Damage is the health the loaded players lost to the action
+    damage = sum(max(0, hp_before[p.id] - p.hp) for p in room.players.values() if p.id in hp_before)
+    if action_data.action == "play_card":
+        count_stat("card", action_data.card_name, total=damage)
+    count_stat("action", action_data.action, total=damage)
+
+
+def count_game(room: RoomState, winners: List[int]):
+    """Count a finished game of a fully loaded room."""
+    now = time.time()
+    count_stat("games", "finished", total=now - room.started_at if room.started_at else 0.0)
+    count_stat("finished", hour_key(now))
+    count_stat("side", room.winner)
+    for player in room.players.values():
+        count_stat("role", player.role, total=int(player.id in winners))
+
+
+@app.get("/stats")
+def get_stats():
+    """Games per hour, game length, win rates per role and card use, from running totals."""
+    return game_stats.report()
+
+
+# Helper Functions
+def get_player_by_id(room: RoomState, player_id: int) -> PlayerState:
+    player = room.players.get(player_id)
     if not player:
-        raise HTTPException(status_code=404, detail="Текущий игрок не найден")
+        raise HTTPException(status_code=404, detail="Игрок не найден")
     return player
 
 
-def calculate_distance(p1_id: int, p2_id: int, room: GameRoom) -> int:
+def calculate_distance(p1_id: int, p2_id: int, room: RoomState) -> int:
     """Расчет расстояния между двумя игроками по кругу"""
     p1 = get_player_by_id(room, p1_id)
     p2 = get_player_by_id(room, p2_id)
-    if not p1 or not p2:
-        raise HTTPException(status_code=404, detail="Игрок не найден")
 
     if p1_id == p2_id:
         return 0
 
-    num_players = len(room.players)
+    num_players = room.seats
     distance = abs(p1.position - p2.position)
     distance = min(distance, num_players - distance)
 
@@ -591,28 +889,35 @@ def calculate_distance(p1_id: int, p2_id: int, room: GameRoom) -> int:
     return distance
 
 
-def get_weapon_range(player: Player) -> int:
+def get_weapon_range(player: PlayerState) -> int:
     weapon_range = WEAPONS.get(player.weapon, 1)  # Default to Colt (range 1)
     if has_permanent_effect(player, "Прицел"):
         weapon_range += 1
     return weapon_range
 
 
-def has_permanent_effect(player: Player, effect_name: str) -> bool:
+def has_permanent_effect(player: PlayerState, effect_name: str) -> bool:
     return effect_name in player.permanent_effects
 
 
-def add_permanent_effect(player: Player, effect_name: str):
+def add_permanent_effect(player: PlayerState, effect_name: str):
     if effect_name not in player.permanent_effects:
         player.permanent_effects.append(effect_name)
 
 
-def remove_permanent_effect(player: Player, effect_name: str):
+def remove_permanent_effect(player: PlayerState, effect_name: str):
     if effect_name in player.permanent_effects:
         player.permanent_effects.remove(effect_name)
 
 
-def handle_shoot(room: GameRoom, shooter: Player, target_player_id: int):
+def discard_from_hand(room: RoomState, player: PlayerState, card_id: int):
+    """Move one card from the player's hand to the discard pile."""
+    player.hand.remove(card_id)
+    storage.remove_from_hand(player.id, card_id)
+    discard_card(room, card_id)
+
+
+def handle_shoot(room: RoomState, shooter: PlayerState, target_player_id: int):
     """Handles the shoot action"""
     target = get_player_by_id(room, target_player_id)
 
@@ -623,567 +928,891 @@ def handle_shoot(room: GameRoom, shooter: Player, target_player_id: int):
         raise HTTPException(status_code=400, detail="Цель вне диапазона выстрела")
 
     # Find the "Бэнг" card in the shooter's hand
-    bang_card = next((card for card in shooter.hand if card.name == "Бэнг"), None)
-
-    if not bang_card:
+    bang_card = find_card(shooter.hand, BANG)
+    if bang_card is None:
         raise HTTPException(status_code=400, detail="Нет карты 'Бэнг' в руке")
 
     # Remove the "Бэнг" card from the shooter's hand and discard it
-    shooter.hand.remove(bang_card)
-    db_remove_card_from_player_hand(shooter.id, bang_card.name)
-
-    db_add_card_to_discard_pile(room.id, bang_card.name)
+    discard_from_hand(room, shooter, bang_card)
 
     # The target player must now defend
     return handle_defend(room, target, shooter)  # Pass the shooter as well
-    # Remove maximum hand
-    reset_hand_size(shooter)
 
 
-def handle_defend(room: GameRoom, target: Player, shooter: Player):
+def handle_defend(room: RoomState, target: PlayerState, shooter: PlayerState):
     """Handles the defending action"""
-    # Check for "Мимо" card
-    mimo_card = next((card for card in target.hand if card.name == "Мимо"), None)
-    if mimo_card:
-        # Remove mimo
-        target.hand.remove(mimo_card)
-        db_remove_card_from_player_hand(target.id, mimo_card.name)
-        db_add_card_to_discard_pile(room.id, mimo_card.name)
-        return {"status": f"Игрок {target.name} уклонился"}
+    with write_set(room) as ws:
+        return resolve_defend(ws, target)
 
-    # Check for "Бочка" effect if no "Mimo" card is available
-    if has_permanent_effect(target, "Бочка"):
-        remove_permanent_effect(target, "Бочка")  # "Бочка" is a one-time use effect
-        card = draw_card(room)  # Drawing card to check effect
 
-        if card and card.suit == "черви":
-            db_add_card_to_discard_pile(room.id, card.name)  # Discard the drawn card
-            return {"status": f"Игрок {target.name} уклонился с помощью бочки!"}
-        elif card:
-            db_add_card_to_discard_pile(room.id, card.name)  # Discard the drawn card if it's not черви
+def draw_card(room: RoomState) -> Optional[int]:
+    """Draw the top card of the deck, reshuffling the discard pile when the deck is empty."""
+    with tracer.span("draw_card"), db_transaction():
+        piles = get_piles(room.id)
+        _transaction_rooms.add(room.id)
+        if not piles.deck:
+            reshuffle_discard_pile(room)
+            if not piles.deck:
+                return None  # No card at all!
+        card = piles.deck.pop()
+        storage.truncate_deck(room.id, len(piles.deck))
+        return card
 
-    # If no "Mimo" card and no "Бочка" effect, the player takes damage
-    target.hp -= 1
-    db_update_player(target)
 
-    check_player_death(target, room)
+def process_dynamite_trigger(room: RoomState):
+    for p2Id, p2 in room.players.items():
+        if has_permanent_effect(p2, 'Динамит'):
+            card = draw_card(room) #Using db method to draw card
+            if card is None:
+                continue
 
-    # You can also implement additional logic to handle specific cases
-    if target.hp <= 0:
-        return {"status": f"Игрок {target.name} убит"}
+            discard_card(room, card) #Discard to discard pool
 
-    return {"status": f"Игрок {target.name} получил выстрел"}  # No defending card
+            value = card_value(card)
+            if card_suit(card) == 'пики' and value is not None and 2 <= value <= 9:
+                # Взрыв! Игрок теряет 3 хп и динамит снимается.
+                p2.hp -= 3
+                remove_permanent_effect(p2, 'Динамит')
 
+                check_player_death(p2, room)
+                storage.update_player(p2) #Update player on DB
 
-def handle_duel(room: GameRoom, p1: Player, p2: Player):
-    """Handles duel action"""
+            else:
+                remove_permanent_effect(p2, 'Динамит')
 
-    def duel_round(attacker: Player, defender: Player) -> bool:
-        """returns True if the duel can continue, False otherwise"""
-        bang_card = next((card for card in attacker.hand if card.name == "Бэнг"), None)
+                storage.update_player(p2)
 
-        if bang_card:
-            attacker.hand.remove(bang_card)
-            db_remove_card_from_player_hand(attacker.id, bang_card.name)
-            db_add_card_to_discard_pile(room.id, bang_card.name)
-        else:
-            # Attacker cannot answer -> he lose
-            defender.hp -= 1
-            db_update_player(defender)
+                #Try to get next alive player
+                next_player = get_next_player(room, p2.id)
+                if next_player:
+                    add_permanent_effect(next_player, 'Динамит')
+                    storage.update_player(next_player)
 
-            check_player_death(defender, room)
-            return False  # end duel
 
-        return True  # Continue duel
+def get_next_player(room: RoomState, current_player_id: int) -> Optional[PlayerState]:
+  """Get next player in a circle"""
+  players = list(room.players.values())
 
-    # Duel rounds
-    current_attacker = p2
-    current_defender = p1  # Player
+  current_idx = next((i for i, p in enumerate(players) if p.id == current_player_id), 0)
+  total = len(players)
 
-    while True:
-        if not duel_round(current_attacker, current_defender):
-            break
+  for i in range(1, total + 1):
+    next_player = players[(current_idx + i) % total]
+    if next_player.is_alive:
+      return next_player
 
-        # Swap players
-        current_attacker, current_defender = current_defender, current_attacker
+  return None #no next player
 
-        # After a shoot
-        if not duel_round(current_attacker, current_defender):
-            break
 
-    # After duel
-    return {"status": "Duel has been completed"}
+def reset_hand_size(player: PlayerState, room: RoomState):
+   with tracer.span("reset_hand_size"):
+      while len(player.hand) > player.hp:
+           card = player.hand[-1] #reset the size
+           discard_from_hand(room, player, card)
 
 
-def handle_play_card(room: GameRoom, player: Player, card_name: str, target_player_id: Optional[int] = None):
-    """Handles the playing of a card"""
-
-    card = next((card for card in player.hand if card.name == card_name), None)
-    if not card:
-        raise HTTPException(status_code=400, detail="Карта не найдена в руке")
-
-    player.hand.remove(card)
-    db_remove_card_from_player_hand(player.id, card.name)
-    db_add_card_to_discard_pile(room.id, card.name)
-
-    if card.name == "Пиво":
-        handle_pivo(player, room)
-        reset_hand_size(player)
-        return {"status": "Пиво использовано", "hp": player.hp}
-
-    elif card.name == "Дилижанс":
-        draw_cards(player, room, 2)
-        reset_hand_size(player)
-        return {"status": "Дилижанс использован"}
-
-    elif card.name == "Уэллс Фарго":
-        draw_cards(player, room, 3)
-        reset_hand_size(player)
-        return {"status": "Уэллс Фарго использован"}
-
-    elif card.name == "Магазин":
-        handle_magazin(player, room)
-        reset_hand_size(player)
-        return {"status": "Магазин использован"}
-
-    elif card.name == "Гатлинг":
-        handle_gatling(room, player)
-        reset_hand_size(player)
-        return {"status": "Гатлинг использован"}
-
-    elif card.name == "Дуэль":
-        if target_player_id == None:
-            raise HTTPException(status_code=400, detail="Не указан целевой игрок")
-        target = get_player_by_id(room, target_player_id)
-        return handle_duel(room, player, target)
-
-    elif card.name == "Тюрьма":
-        if target_player_id == None:
-            raise HTTPException(status_code=400, detail="Не указан целевой игрок")
-
-        handle_turma(player, get_player_by_id(room, target_player_id))
-        reset_hand_size(player)
-        return {"status": "Тюрьма применена на целевого игрока"}
-
-    elif card.name == "Динамит":
-        handle_dynamite(room)
-        reset_hand_size(player)
-        return {"status": "Динамит применен"}
-
-    elif card.name == "Бочка":
-        handle_bocka(player)
-        reset_hand_size(player)
-        return {"status": "Бочка применена"}
-
-    elif card.name == "Мустанг":
-        handle_pivo(player, room)
-        reset_hand_size(player)
-        add_permanent_effect(player, card.name)
-        return {"status": "Мустанг был применен"}
-    elif card.name == "Прицел":
-        handle_pivo(player, room)
-        reset_hand_size(player)
-        add_permanent_effect(player, card.name)
-        return {"status": "Прицел был применен"}
-    elif card.name == "Скофилд":
-        handle_pivo(player, room)
-        reset_hand_size(player)
-        add_permanent_effect(player, card.name)
-        return {"status": "Скофилд был применен"}
-    elif card.name == "Паника":
-        handle_panic(player, room)
-        reset_hand_size(player)
-        return {"status": "Паника применена"}
-    elif card.name == "Красотка":
-        handle_krassotka(player, room)
-        reset_hand_size(player)
-        return {"status": "Красотка применена"}
-
-    reset_hand_size(player)
-    return {"status": f"Карта '{card_name}' сыграна"}
-def draw_card(room: GameRoom) -> Card:
-    """Draw a card from the deck using database operations."""
-    deck = db_get_deck(room.id)
-    if deck:
-        card = deck.pop(0)
-        db_remove_card_from_deck(room.id, card.name)
-        # Update the deck positions in the database after removing a card.
-        for i, remaining_card in enumerate(deck):
-            db_add_card_to_deck(room.id, remaining_card.name, i) # update positions, in fact
-        return card
-    else:
-        reshuffle_discard_pile(room)
-        deck = db_get_deck(room.id)
-        if deck:
-            card = deck.pop(0)
-            db_remove_card_from_deck(room.id, card.name)
-            return card
-        else:
-            return None  # No card at all!
+def check_player_death(player: PlayerState, room: RoomState):
+    # Callers persist the player afterwards
+    with tracer.span("check_player_death"):
+        if player.hp <= 0:
+            player.is_alive = False
+            _transaction_deaths.add(room.id)
 
-def process_dynamite_trigger(room: GameRoom):
-    for p in list(room.players.values()):
-        if has_permanent_effect(p, 'Динамит'):
-            card = draw_card(room) #Using db method to draw card
-            if not card:
-                continue
-            if card.suit == 'пики' and 2 <= card.value and card.value <= 9:
-                # Взрыв! Игрок теряет 3 хп и динамит снимается.
-                p.hp -= 3
-                remove_permanent_effect(p, 'Динамит')
-                db_update_player(p) #Update player on DB
-                db_add_card_to_discard_pile(room.id, card.name) #Discard to discard pool
-                check_player_death(p, room)
-            else:
-                add_permanent_effect(p, 'Динамит')
-                db_update_player(p)
-                db_add_card_to_discard_pile(room.id, card.name)
 
-def get_next_player(room: GameRoom, current_player_id: int) -> Optional[Player]:
-  """Get next player in a circle"""
-  players = {p_id: db_get_player(p_id) for p_id in room.players}
-  current_idx = next((i for i, p in enumerate(players.values()) if p.id == current_player_id), 0)
-  total = len(players)
-  for i in range(1, total + 1):
-    next_idx = (current_idx + i) % total
-    next_player = list(players.values())[next_idx] #Changed to work with dict
-    if next_player.is_alive:
-      return next_player
+# End of the game
+# A death marks the room; before the transaction that caused it commits (deaths of
+# a Гатлинг land together) the whole room is loaded and checked for a winner. A
+# tournament match still going after the tournament's max_turns is decided on
+# health, so every match ends; other games end only on deaths.
+WINNING_ROLES = {"шериф": ("шериф", "помощник"), "бандиты": ("бандит",), "ренегат": ("ренегат",)}
 
-  return None #no next player
 
-def reset_hand_size(player : Player):
-   while len(player.hand) > player.hp:
-        card = player.hand.pop() #reset the size
-        db_remove_card_from_player_hand(player.id, card.name) #remove on DB
-        #Discard ?
+def game_winner(room: RoomState) -> Optional[str]:
+    """Side that has won, or None while the game goes on."""
+    alive = [p.role for p in room.players.values() if p.is_alive]
+    if "шериф" not in alive:
+        return "ренегат" if alive == ["ренегат"] else "бандиты"
+    if "бандит" not in alive and "ренегат" not in alive:
+        return "шериф"
+    return None
+
+
+def end_game_if_over(room_id: int):
+    room = storage.get_room(room_id)
+    if not room or not room.roles_assigned or room.winner is not None:
+        return
+    winner = game_winner(room)
+    if winner is not None:
+        end_game(room, winner)
+
 
-def check_player_death(player: Player, room: GameRoom):
-    if player.hp <= 0:
-        player.is_alive = False
-        db_update_player(player) #Also update
+def health_winner(room: RoomState) -> str:
+    """Side that kept the largest share of its health (dead players keep none); the sheriff's side wins a tie."""
+    share = {}
+    for side, roles in WINNING_ROLES.items():
+        players = [p for p in room.players.values() if p.role in roles]
+        if players:
+            share[side] = sum(p.hp for p in players if p.is_alive) / sum(p.max_hp for p in players)
+    return max(share, key=lambda side: (share[side], side == "шериф"))
 
-def pass_turn(room: GameRoom):
+
+def end_game(room: RoomState, winner: str):
+    """End the game of a fully loaded room with winner as the winning side."""
+    room_id = room.id
+    room.winner = winner
+    storage.update_room(room)
+    set_timer(("turn", room_id), None)
+    # A side wins together with its dead players; of the renegades only the one alive wins
+    winners = [p.id for p in room.players.values()
+               if p.role in WINNING_ROLES[winner] and (winner != "ренегат" or p.is_alive)]
+    db_on_commit(("game_over", room_id), lambda: match_finished(room_id, winners))
+    count_game(room, winners)
+
+
+def pass_turn(room: RoomState):
     """Advances the game turn to the next player."""
     advance_turn(room)
 
-def advance_turn(room: GameRoom):
-   players = {p_id: db_get_player(p_id) for p_id in room.players}
-   current_idx = next((i for i, p in enumerate(players.values()) if p.id == room.current_player_id), 0)
-   total = len(players)
-
-   for i in range(1, total + 1):
-        next_idx = (current_idx + i) % total
-        next_player = list(players.values())[next_idx] # List because it is needed
-        if next_player.is_alive:
-            room.current_player_id = next_player.id
-            db_update_room(room) #Update to new player
-            break
 
-def check_turma(player: Player, room: GameRoom) -> bool:
+def advance_turn(room: RoomState):
+   next_player = get_next_player(room, room.current_player_id)
+   if next_player:
+        room.current_player_id = next_player.id
+        room.turn += 1
+        max_turns = match_max_turns(room.id)
+        if max_turns and room.turn >= max_turns:
+            end_game(room, game_winner(room) or health_winner(room))
+            return
+        storage.update_room(room) #Update to new player
+        arm_turn_timer(room)
+        if next_player.is_bot:
+            queue_bot_turn(room.id)
+
+
+def check_turma(player: PlayerState, room: RoomState) -> bool:
     card = draw_card(room)
-    if card and card.suit == "черви":
+    if card is not None and card_suit(card) == "черви":
         remove_permanent_effect(player, "Тюрьма")
-        db_update_player(player)
-        db_add_card_to_discard_pile(room.id, card.name)
+        storage.update_player(player)
+        discard_card(room, card)
         return True  # Освобожден
     else:
-        if card:
-            db_add_card_to_discard_pile(room.id, card.name)
+        if card is not None:
+            discard_card(room, card)
         return False
 
-def handle_krassotka(player: Player, room: GameRoom):
-  """Handles Krassotka effect action, take a random card"""
-  room = db_get_room(room.id) #need to reload
 
-  if not room.current_player_id:
-        raise HTTPException(status_code=500, detail="Текущий игрок не определен")
+# Batched resolution
+# Effects that touch several players (Гатлинг, Магазин, Паника, Красотка) resolve
+# against the in-memory room and piles only; the changes are written once at the
+# end, as a handful of executemany statements whatever the number of players.
+class WriteSet:
+    __slots__ = ("room", "piles", "players", "hands", "deck_size", "discard_size", "reshuffled")
+
+    def __init__(self, room: RoomState):
+        self.room = room
+        self.piles = get_piles(room.id)
+        self.players: Dict[int, PlayerState] = {}  # players to update
+        self.hands: Dict[int, array] = {}  # player id -> hand before the batch
+        self.deck_size = len(self.piles.deck)
+        self.discard_size = len(self.piles.discard)
+        self.reshuffled = False
+
+    def touch(self, player: PlayerState):
+        self.players[player.id] = player
+
+    def take(self, player: PlayerState, card_id: int):
+        """Remove a card from the player's hand."""
+        if player.id not in self.hands:
+            self.hands[player.id] = array("H", player.hand)
+        player.hand.remove(card_id)
+
+    def give(self, player: PlayerState, card_id: int):
+        """Add a card to the player's hand."""
+        if player.id not in self.hands:
+            self.hands[player.id] = array("H", player.hand)
+        player.hand.append(card_id)
+
+    def discard(self, card_id: int):
+        self.piles.discard.append(card_id)
+
+    def draw(self) -> Optional[int]:
+        """Draw the top card of the deck, reshuffling the discard pile when the deck is empty."""
+        piles = self.piles
+        if not piles.deck:
+            if not piles.discard:
+                return None
+            piles.deck, piles.discard = piles.discard, piles.deck
+            room_rng(self.room.id).shuffle(piles.deck)
+            self.reshuffled = True
+        return piles.deck.pop()
+
+    def flush(self):
+        if self.players:
+            storage.update_players(list(self.players.values()))
+        removed, added = [], []
+        for player_id, before in self.hands.items():
+            hand = self.room.players[player_id].hand
+            removed.extend((player_id, card_id) for card_id in set(before).difference(hand))
+            kept = set(before)
+            added.extend((player_id, card_id) for card_id in hand if card_id not in kept)
+        storage.update_hands(removed, added)
+        if self.reshuffled:
+            # Both piles were rebuilt; rewrite them
+            storage.replace_piles(self.room.id, self.piles.deck, self.piles.discard)
+            return
+        deck, discard = self.piles.deck, self.piles.discard
+        if len(deck) < self.deck_size:
+            storage.truncate_deck(self.room.id, len(deck))
+        if len(discard) > self.discard_size:
+            storage.append_discard(self.room.id, self.discard_size, discard[self.discard_size:])
+
+
+@contextmanager
+def write_set(room: RoomState):
+    """Collect the changes of one effect and write them when the block exits."""
+    with db_transaction():
+        _transaction_rooms.add(room.id)
+        ws = WriteSet(room)
+        yield ws
+        with tracer.span("write_set.flush"):
+            ws.flush()
+
+
+def resolve_defend(ws: WriteSet, target: PlayerState) -> dict:
+    """Resolve one shot at target: Мимо, then Бочка, then damage."""
+    # Check for "Мимо" card
+    mimo_card = find_card(target.hand, MIMO)
+    if mimo_card is not None:
+        ws.take(target, mimo_card)
+        ws.discard(mimo_card)
+        return {"status": f"Игрок {target.name} уклонился"}
 
-  players = {p_id: db_get_player(p_id) for p_id in room.players}
+    # Check for "Бочка" effect if no "Mimo" card is available
+    if has_permanent_effect(target, "Бочка"):
+        remove_permanent_effect(target, "Бочка")  # "Бочка" is a one-time use effect
+        ws.touch(target)
+        card = ws.draw()  # Drawing card to check effect
 
-  for p2Id, p2 in players.items():
-    if p2Id != room.current_player_id and p2.hand:
-           #Remove a random card from target
-           card_to_steal_index = random.randint(0, len(p2.hand) - 1)
-           card_to_steal = p2.hand[card_to_steal_index]
-           p2.hand.remove(card_to_steal)
-           db_remove_card_from_player_hand(p2.id, card_to_steal.name)
+        if card is not None:
+            ws.discard(card)  # Discard the drawn card
+            if card_suit(card) == "черви":
+                return {"status": f"Игрок {target.name} уклонился с помощью бочки!"}
 
-           #Add card
-           player.hand.append(card_to_steal)
-           db_add_card_to_player_hand(player.id, card_to_steal.name)
-           db_update_player(player)
-           db_update_player(p2)
-           db_add_card_to_discard_pile(room.id, card_to_steal.name) #remove from discard pile
+    # If no "Mimo" card and no "Бочка" effect, the player takes damage
+    target.hp -= 1
+    check_player_death(target, ws.room)
+    ws.touch(target)
 
-def handle_panic(player: Player, room: GameRoom):
-  """Handles Panika effect action, take a random card"""
-  if not room.current_player_id:
-        raise HTTPException(status_code=500, detail="Текущий игрок не определен")
+    if target.hp <= 0:
+        return {"status": f"Игрок {target.name} убит"}
+
+    return {"status": f"Игрок {target.name} получил выстрел"}  # No defending card
 
-  players = {p_id: db_get_player(p_id) for p_id in room.players}
 
-  for p2Id, p2 in players.items():
-    if p2Id != room.current_player_id and p2.hand:
-           #Remove a random card from target
-           card_to_steal_index = random.randint(0, len(p2.hand) - 1)
-           card_to_steal = p2.hand[card_to_steal_index]
-           p2.hand.remove(card_to_steal)
-           db_remove_card_from_player_hand(p2.id, card_to_steal.name)
+# Card effects
+# Every card kind with an effect is registered once, at import, with the state its
+# handler needs. apply_action looks the effect up by kind and loads exactly that
+# state (the acting player, the target, or every player of the room) before
+# calling the handler; cards without a registered effect are simply discarded.
+class EffectContext:
+    __slots__ = ("room", "player", "target", "card")
 
-           #Add card
-           player.hand.append(card_to_steal)
-           db_add_card_to_player_hand(player.id, card_to_steal.name)
-           db_update_player(player)
-           db_update_player(p2)
+    def __init__(self, room: RoomState, player: PlayerState, target: Optional[PlayerState], card: int):
+        self.room = room
+        self.player = player
+        self.target = target
+        self.card = card
 
-def handle_pivo(player: Player, room: GameRoom):
+
+class CardEffect:
+    __slots__ = ("handler", "needs_target", "needs_players", "reset_hand")
+
+    def __init__(self, handler: Callable[[EffectContext], dict], needs_target: bool, needs_players: bool,
+                 reset_hand: bool):
+        self.handler = handler
+        self.needs_target = needs_target  # a target player must be given and is loaded
+        self.needs_players = needs_players  # every player of the room is loaded
+        self.reset_hand = reset_hand  # reset_hand_size of the acting player afterwards
+
+
+CARD_EFFECTS: Dict[int, CardEffect] = {}  # card kind -> effect
+
+
+def card_effect(*names: str, needs_target: bool = False, needs_players: bool = False, reset_hand: bool = True):
+    def register(handler: Callable[[EffectContext], dict]):
+        for name in names:
+            CARD_EFFECTS[CARD_KINDS[name]] = CardEffect(handler, needs_target, needs_players, reset_hand)
+        return handler
+    return register
+
+
+def play_card(ctx: EffectContext, effect: Optional[CardEffect]) -> dict:
+    """Discard the played card and apply its effect."""
+    discard_from_hand(ctx.room, ctx.player, ctx.card)
+    if effect is None:
+        result = {"status": f"Карта '{card_name(ctx.card)}' сыграна"}
+    else:
+        result = effect.handler(ctx)
+    if effect is None or effect.reset_hand:
+        reset_hand_size(ctx.player, ctx.room)
+    return result
+
+
+@card_effect("Пиво")
+def handle_pivo(ctx: EffectContext):
+    player = ctx.player
     if player.hp < player.max_hp:
         player.hp += 1
-        db_update_player(player) #Update Player
+        storage.update_player(player) #Update Player
+    return {"status": "Пиво использовано", "hp": player.hp}
 
-def handle_magazin(player: Player, room: GameRoom):
-   for _ in range(len(room.players.values())):  # number of players
-        card = draw_card(room)
 
-        if card:
-            player.hand.append(card) #add to current player hand
-            db_add_card_to_player_hand(player.id, card.name)
-            db_update_player(player)
-        else:
-            reshuffle_discard_pile(room)
-            card = draw_card(room)
-            if card:
-                player.hand.append(card)
-                db_add_card_to_player_hand(player.id, card.name)
-                db_update_player(player)
-            else:
-                break #No more card possible to add
+@card_effect("Дилижанс")
+def handle_dilizhans(ctx: EffectContext):
+    draw_cards(ctx.player, ctx.room, 2)
+    return {"status": "Дилижанс использован"}
 
-def handle_gatling(room: GameRoom, p1: Player):
-    """Handles the Gatling card"""
-    # Fire at everyone who can be defended
-    players = {p_id: db_get_player(p_id) for p_id in room.players}
-
-    for p2Id, p2 in players.items():
-        # Avoid shooting yourself
-        if p2Id != p1.id:
-            handle_defend(room, p2, p1)
-
-def handle_turma(p1: Player, p2: Player):
-
-    add_permanent_effect(p2, 'Тюрьма')
-    db_update_player(p2) #Update player
-
-def draw_card(room: GameRoom) -> Card:
-    """Draw a card from the deck using database operations."""
-    deck = db_get_deck(room.id)
-    if deck:
-        card = deck.pop(0)
-        db_remove_card_from_deck(room.id, card.name)
-        # Update the deck positions in the database after removing a card.
-        deck_reload = db_get_deck(room.id)
-        for i, remaining_card in enumerate(deck_reload):
-            cursor.execute("UPDATE deck SET position = ? WHERE room_id = ? AND card_name = ?",
-                        (i, room.id, remaining_card.name))
-        conn.commit()
-        return card
-    else:
-        reshuffle_discard_pile(room)
-        deck = db_get_deck(room.id)
-        if deck:
-            card = deck.pop(0)
-            db_remove_card_from_deck(room.id, card.name)
-            deck_reload = db_get_deck(room.id)
-            for i, remaining_card in enumerate(deck_reload):
-                cursor.execute("UPDATE deck SET position = ? WHERE room_id = ? AND card_name = ?",
-                            (i, room.id, remaining_card.name))
-            conn.commit()
-            return card
-        else:
-            return None  # No card at all!
 
-def handle_dynamite(room: GameRoom):
-     for p in list(room.players.values()):
-        if has_permanent_effect(p, 'Динамит'):
-            return
+@card_effect("Уэллс Фарго")
+def handle_wells_fargo(ctx: EffectContext):
+    draw_cards(ctx.player, ctx.room, 3)
+    return {"status": "Уэллс Фарго использован"}
 
-     #Apply dynamite
-     for p in list(room.players.values()):
-        add_permanent_effect(p, 'Динамит')
-        db_update_player(p)
 
-def handle_bocka(player: Player):
-  add_permanent_effect(player, 'Бочка')
-  db_update_player(player)
+@card_effect("Магазин")
+def handle_magazin(ctx: EffectContext):
+    # One card for every other player at the table
+    with write_set(ctx.room) as ws:
+        for _ in range(ctx.room.seats - 1):
+            card = ws.draw()
+            if card is None:
+                break
+            ws.give(ctx.player, card)
+    return {"status": "Магазин использован"}
 
-def process_dynamite_trigger(room: GameRoom):
-    #Get fresh room for correct player's properties
-    room = db_get_room(room.id)
-    players = {p_id: db_get_player(p_id) for p_id in room.players} #Get all players
 
-    for p2Id, p2 in players.items():
-        if has_permanent_effect(p2, 'Динамит'):
-            card = draw_card(room) #Using db method to draw card
-            if not card:
-                continue
+@card_effect("Гатлинг", needs_players=True)
+def handle_gatling(ctx: EffectContext):
+    """Handles the Gatling card"""
+    # Fire at everyone who can be defended
+    with write_set(ctx.room) as ws:
+        for p2Id, p2 in ctx.room.players.items():
+            # Avoid shooting yourself
+            if p2Id != ctx.player.id and p2.is_alive:
+                resolve_defend(ws, p2)
+    return {"status": "Гатлинг использован"}
 
-            db_add_card_to_discard_pile(room.id, card.name) #Discard to discard pool
 
-            if card.suit == 'пики' and 2 <= card.value and card.value <= 9:
-                # Взрыв! Игрок теряет 3 хп и динамит снимается.
-                p2.hp -= 3
-                remove_permanent_effect(p2, 'Динамит')
+@card_effect("Дуэль", needs_target=True, reset_hand=False)
+def handle_duel(ctx: EffectContext):
+    """Handles duel action"""
+    room = ctx.room
 
-                db_update_player(p2) #Update player on DB
-                check_player_death(p2, room)
+    def duel_round(attacker: PlayerState, defender: PlayerState) -> bool:
+        """returns True if the duel can continue, False otherwise"""
+        bang_card = find_card(attacker.hand, BANG)
+        if bang_card is not None:
+            discard_from_hand(room, attacker, bang_card)
+        else:
+            # Attacker cannot answer -> he lose
+            defender.hp -= 1
+            check_player_death(defender, room)
+            storage.update_player(defender)
+            return False  # end duel
 
-            else:
-                remove_permanent_effect(p2, 'Динамит')
+        return True  # Continue duel
 
-                db_update_player(p2)
+    # Duel rounds
+    current_attacker = ctx.target
+    current_defender = ctx.player  # Player
 
-                #Try to get next alive player
-                next_player = get_next_player(room, p2.id)
-                if next_player:
-                    add_permanent_effect(next_player, 'Динамит')
-                    db_update_player(next_player)
+    while True:
+        if not duel_round(current_attacker, current_defender):
+            break
 
-def get_next_player(room: GameRoom, current_player_id: int) -> Optional[Player]:
-  """Get next player in a circle"""
+        # Swap players
+        current_attacker, current_defender = current_defender, current_attacker
 
-  players = {p_id: db_get_player(p_id) for p_id in room.players}
+        # After a shoot
+        if not duel_round(current_attacker, current_defender):
+            break
 
-  current_idx = next((i for i, p in enumerate(players.values()) if p.id == current_player_id), 0)
-  total = len(players)
+    # After duel
+    return {"status": "Duel has been completed"}
 
-  for i in range(1, total + 1):
-    next_idx = (current_idx + i) % total
-    next_player = list(players.values())[next_idx] #Changed to work with dict
-    if next_player.is_alive:
-      return next_player
 
-  return None #no next player
+@card_effect("Тюрьма", needs_target=True)
+def handle_turma(ctx: EffectContext):
+    add_permanent_effect(ctx.target, 'Тюрьма')
+    storage.update_player(ctx.target) #Update player
+    return {"status": "Тюрьма применена на целевого игрока"}
 
-def reset_hand_size(player : Player):
-   while len(player.hand) > player.hp:
-        card = player.hand.pop() #reset the size
-        db_remove_card_from_player_hand(player.id, card.name) #remove on DB
-        #Discard ?
 
-def check_player_death(player: Player, room: GameRoom):
-    #Need to get fresh values from DB
-    player = db_get_player(player.id)
+@card_effect("Динамит", needs_players=True)
+def handle_dynamite(ctx: EffectContext):
+    players = ctx.room.players.values()
+    if not any(has_permanent_effect(p, 'Динамит') for p in players):
+        #Apply dynamite
+        for p in players:
+            add_permanent_effect(p, 'Динамит')
+            storage.update_player(p)
+    return {"status": "Динамит применен"}
 
-    if player.hp <= 0:
-        player.is_alive = False
-        db_update_player(player) #Also update
 
-def pass_turn(room: GameRoom):
-    """Advances the game turn to the next player."""
-    room = db_get_room(room.id)
-    advance_turn(room)
+@card_effect("Бочка")
+def handle_bocka(ctx: EffectContext):
+    add_permanent_effect(ctx.player, 'Бочка')
+    storage.update_player(ctx.player)
+    return {"status": "Бочка применена"}
 
-def advance_turn(room: GameRoom):
-   players = {p_id: db_get_player(p_id) for p_id in room.players}
-   current_idx = next((i for i, p in enumerate(players.values()) if p.id == room.current_player_id), 0)
-   total = len(players)
-
-   for i in range(1, total + 1):
-        next_idx = (current_idx + i) % total
-        next_player = list(players.values())[next_idx] # List because it is needed
-        if next_player.is_alive:
-            room.current_player_id = next_player.id
-            db_update_room(room) #Update to new player
-            break
 
-def check_turma(player: Player, room: GameRoom) -> bool:
-    card = draw_card(room)
-    if card and card.suit == "черви":
-        remove_permanent_effect(player, "Тюрьма")
-        db_update_player(player)
-        db_add_card_to_discard_pile(room.id, card.name)
-        return True  # Освобожден
+@card_effect("Мустанг", "Прицел", "Скофилд")
+def handle_equipment(ctx: EffectContext):
+    """Put a card in play: weapons replace the current weapon, others become permanent effects."""
+    name = card_name(ctx.card)
+    if name in WEAPONS:
+        ctx.player.weapon = name
     else:
-        if card:
-            db_add_card_to_discard_pile(room.id, card.name)
-        return False
+        add_permanent_effect(ctx.player, name)
+    storage.update_player(ctx.player)
+    return {"status": f"{name} был применен"}
 
-def handle_krassotka(player: Player, room: GameRoom):
-  """Handles Krassotka effect action, take a random card"""
-  #Need to get fresh room for correct player's properties
-  room = db_get_room(room.id) #Need to reload
 
+@card_effect("Паника", needs_players=True)
+def handle_panic(ctx: EffectContext):
+  """Handles Panika effect action, take a random card"""
+  room, player = ctx.room, ctx.player
   if not room.current_player_id:
         raise HTTPException(status_code=500, detail="Текущий игрок не определен")
 
-  players = {p_id: db_get_player(p_id) for p_id in room.players}
+  rng = room_rng(room.id)
+  with write_set(room) as ws:
+    for p2Id, p2 in room.players.items():
+      if p2Id != room.current_player_id and p2.hand:
+          #Move a random card from target
+          card_to_steal = p2.hand[rng.randint(0, len(p2.hand) - 1)]
+          ws.take(p2, card_to_steal)
+          ws.give(player, card_to_steal)
+  return {"status": "Паника применена"}
+
+
+@card_effect("Красотка", needs_players=True)
+def handle_krassotka(ctx: EffectContext):
+  """Handles Krassotka effect action, every other player discards a random card"""
+  room = ctx.room
+  if not room.current_player_id:
+        raise HTTPException(status_code=500, detail="Текущий игрок не определен")
 
-  for p2Id, p2 in players.items():
-    if p2Id != room.current_player_id and p2.hand:
-           #Remove a random card from target
-           card_to_steal_index = random.randint(0, len(p2.hand) - 1)
-           card_to_steal = p2.hand[card_to_steal_index]
-           p2.hand.remove(card_to_steal)
-           db_remove_card_from_player_hand(p2.id, card_to_steal.name)
+  rng = room_rng(room.id)
+  with write_set(room) as ws:
+    for p2Id, p2 in room.players.items():
+      if p2Id != room.current_player_id and p2.hand:
+           #Discard a random card of target
+           card_to_discard = p2.hand[rng.randint(0, len(p2.hand) - 1)]
+           ws.take(p2, card_to_discard)
+           ws.discard(card_to_discard)
+  return {"status": "Красотка применена"}
+
+
+# Profiling
+# POST /admin/profile arms a profiling session for the next N requests of the
+# routes above (route is the handler name, e.g. player_action), optionally only
+# for one action and card. GET returns the running or last session.
+PROFILE_DIR = os.environ.get("BANG_PROFILE_DIR")  # finished sessions are also saved here
+ADMIN_TOKEN = os.environ.get("BANG_ADMIN_TOKEN")  # required in X-Admin-Token; admin routes are off without it
+PROFILE_MAX_REQUESTS = 10000
+
+profiler = Profiler(PROFILE_DIR)
+
+
+def check_admin(token: Optional[str]):
+    if not ADMIN_TOKEN or not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+
+@app.post("/admin/profile")
+def start_profiling(mode: str = "sample", requests: int = 100, route: Optional[str] = None,
+                    action: Optional[str] = None, card: Optional[str] = None, interval: float = 0.001,
+                    x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"Режим профилирования: {', '.join(PROFILE_MODES)}")
+    if not 1 <= requests <= PROFILE_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"requests: от 1 до {PROFILE_MAX_REQUESTS}")
+    session = ProfileSession(mode, requests, route, action, card, max(interval, 0.0001))
+    profiler.start(session)
+    return session.report()
+
+
+@app.get("/admin/profile")
+def get_profile(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    session = profiler.session or profiler.last
+    if session is None:
+        raise HTTPException(status_code=404, detail="Профилирование не запускалось")
+    return session.report()
+
+
+@app.delete("/admin/profile")
+def stop_profiling(x_admin_token: Optional[str] = Header(None)):
+    check_admin(x_admin_token)
+    session = profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=404, detail="Профилирование не запущено")
+    return session.report()
+
+
+# Turn timeouts
+# A single timer wheel holds the turn timer and the idle timer of every room; one
+# background task advances it, passes expired turns and removes abandoned rooms.
+# Timers change when the transaction that moved the turn commits, so a rolled back
+# action cannot leave a turn timer for a player who never got the turn.
+TURN_TIMEOUT = float(os.environ.get("BANG_TURN_TIMEOUT", "60"))  # seconds per turn
+ROOM_IDLE_TIMEOUT = float(os.environ.get("BANG_ROOM_IDLE_TIMEOUT", "1800"))  # seconds without any request to the room
+TIMER_TICK = 1.0
+
+timers = TimerWheel(tick=TIMER_TICK, start=time.monotonic())
+_scheduler_task: Optional[asyncio.Task] = None
+
+
+def set_timer(key: Tuple[str, int], delay: Optional[float], payload: object = None):
+    """Arm key, or cancel it when delay is None, once the open transaction commits."""
+    if delay is None:
+        db_on_commit(("timer", key), lambda: timers.cancel(key))
+    else:
+        db_on_commit(("timer", key), lambda: timers.arm(key, delay, payload))
 
-           #Add card
-           player.hand.append(card_to_steal)
-           db_add_card_to_player_hand(player.id, card_to_steal.name)
-           db_update_player(player)
-           db_update_player(p2)
-           db_add_card_to_discard_pile(room.id, card_to_steal.name) #remove from discard pile
 
-def handle_panic(player: Player, room: GameRoom):
-  """Handles Panika effect action, take a random card"""
-  room = db_get_room(room.id)
+def arm_turn_timer(room: RoomState):
+    set_timer(("turn", room.id), TURN_TIMEOUT, room.current_player_id)
 
-  if not room.current_player_id:
-        raise HTTPException(status_code=500, detail="Текущий игрок не определен")
 
-  players = {p_id: db_get_player(p_id) for p_id in room.players}
+def touch_room(room_id: int):
+    set_timer(("idle", room_id), ROOM_IDLE_TIMEOUT)
 
-  for p2Id, p2 in players.items():
-    #Need to get fresh properties in order to draw cards
-    p2 = db_get_player(p2Id)
-    if p2Id != room.current_player_id and len(p2.hand) != 0:
-        print("Player Name with action is", p2.name)
-        #Remove a random card from target
-        card_to_steal_index = random.randint(0, len(p2.hand) - 1)
-        card_to_steal = p2.hand[card_to_steal_index]
 
-        if not card_to_steal:
-           return
+def db_delete_room(room_id: int):
+    with db_transaction():
+        storage.delete_room(room_id)
+        _room_piles.pop(room_id, None)
+        _room_views.pop(room_id, None)
+        db_on_commit(("game_over", room_id), lambda: match_finished(room_id, []))  # an abandoned match has no winner
 
-        db_remove_card_from_player_hand(p2Id, card_to_steal.name)
 
-        #Add card
-        card = db_get_card(card_to_steal.name)
-        player.hand.append(card)
-        db_add_card_to_player_hand(player.id, card.name)
+def delete_room(room_id: int):
+    with db_transaction():
+        db_delete_room(room_id)
+        set_timer(("turn", room_id), None)
+        set_timer(("idle", room_id), None)
+        room_changed(room_id)  # wake waiters so they see the room is gone
+        db_on_commit(("forget", room_id), lambda: room_watchers.forget(room_id))
+        db_on_commit(("lobby", room_id), lambda: open_rooms.remove(room_id))
 
-def handle_pivo(player: Player, room: GameRoom):
-    if player.hp < player.max_hp:
-        player.hp += 1
-        db_update_player(player) #Update Player
 
-def handle_magazin(player: Player, room: GameRoom):
-    players = {p_id: db_get_player(p_id) for p_id in room.players}
+def process_expired_timers(expired: List[Tuple[Hashable, object]]):
+    for key, payload in expired:
+        kind, room_id = key
+        try:
+            with db_transaction():
+                if kind == "idle":
+                    delete_room(room_id)
+                    continue
+                room = storage.get_room(room_id)
+                # The player may have acted since the timer fired
+                if room and room.game_started and room.winner is None and room.current_player_id == payload:
+                    hp_before = {p.id: p.hp for p in room.players.values()}
+                    action = PlayerAction(player_id=payload, action="pass")
+                    pass_turn(room)
+                    record_action(room_id, action, {"status": "ход передан"})
+                    count_action(room, action, hp_before)
+                    room_changed(room_id)
+        except Exception:
+            # The timer has left the wheel: retry later rather than leave the room without one
+            log.exception("Timer %s failed", key)
+            timers.arm(key, TURN_TIMEOUT if kind == "turn" else ROOM_IDLE_TIMEOUT, payload)
+
+
+# Bots
+# Bot seats are played inside the process. A room is queued when the turn passes to
+# a bot; every scheduler tick takes the whole queue and plays those turns in one
+# threadpool call, deciding against the loaded room instead of over HTTP.
+BOT_MAX_ACTIONS = 10  # actions per bot turn before it passes anyway
+BOT_DRAW_CARDS = ("Дилижанс", "Уэллс Фарго", "Магазин")
+BOT_EQUIPMENT = ("Мустанг", "Прицел", "Бочка")
+
+_bot_rooms = set()  # rooms where a bot is to move
+_bot_rooms_lock = threading.Lock()
+
+
+def queue_bot_turn(room_id: int):
+    def add():
+        with _bot_rooms_lock:
+            _bot_rooms.add(room_id)
+    db_on_commit(("bot", room_id), add)
+
+
+def take_bot_rooms() -> List[int]:
+    with _bot_rooms_lock:
+        room_ids = sorted(_bot_rooms)
+        _bot_rooms.clear()
+    return room_ids
+
+
+def decide_bot_action(room: RoomState, bot: PlayerState, has_shot: bool) -> PlayerAction:
+    """Next action of a bot: heal, draw, equip, shoot the weakest player in range, then pass."""
+    names = {card_name(card_id) for card_id in bot.hand}
+
+    def play(name: str, target_id: Optional[int] = None) -> PlayerAction:
+        return PlayerAction(player_id=bot.id, action="play_card", card_name=name, target_player_id=target_id)
+
+    if "Пиво" in names and bot.hp < bot.max_hp:
+        return play("Пиво")
+    for name in BOT_DRAW_CARDS:
+        if name in names:
+            return play(name)
+    for name in BOT_EQUIPMENT:
+        if name in names and not has_permanent_effect(bot, name):
+            return play(name)
+    if "Скофилд" in names and WEAPONS.get(bot.weapon, 1) < WEAPONS["Скофилд"]:
+        return play("Скофилд")
+
+    opponents = [p for p in room.players.values() if p.id != bot.id and p.is_alive]
+    if opponents:
+        if not has_shot and "Бэнг" in names:
+            weapon_range = get_weapon_range(bot)
+            in_range = [p for p in opponents if calculate_distance(bot.id, p.id, room) <= weapon_range]
+            if in_range:
+                target = min(in_range, key=lambda p: p.hp)
+                return PlayerAction(player_id=bot.id, action="shoot", target_player_id=target.id)
+        if "Гатлинг" in names:
+            return play("Гатлинг")
+    return PlayerAction(player_id=bot.id, action="pass")
+
+
+def play_bot_turn(room_id: int):
+    """Play the current turn of room_id if it belongs to a bot."""
+    has_shot = False
+    for step in range(BOT_MAX_ACTIONS + 1):
+        room = storage.get_room(room_id)
+        if not room or not room.game_started or room.winner is not None:
+            return
+        bot = room.players.get(room.current_player_id)
+        if not bot or not bot.is_bot:
+            return
+        touch_room(room_id)  # a room played by bots is not abandoned
+        if not bot.is_alive:
+            hp_before = {p.id: p.hp for p in room.players.values()}
+            action = PlayerAction(player_id=bot.id, action="pass")
+            pass_turn(room)
+            record_action(room_id, action, {"status": "ход передан"})
+            count_action(room, action, hp_before)
+            room_changed(room_id)
+            return
+        action = decide_bot_action(room, bot, has_shot)
+        if step == BOT_MAX_ACTIONS:
+            action = PlayerAction(player_id=bot.id, action="pass")
+        apply_action(room_id, action)
+        room_changed(room_id)
+        if action.action == "pass":
+            return
+        has_shot = has_shot or action.action == "shoot"
 
-    for p2Id, p2 in players.items():
-      if p2Id != player.id:
-        card = draw_card(room)
 
-        if card:
-            player.hand.append(card) #add to current player hand
-            db_add_card_to_player_hand(player.id, card.name) # and add to db player hand
-            db_update_player(player)
-        else:
-            reshuffle_discard_pile(room)
-            card = draw_card(room)
-            if card:
-                player.hand.append(card)
-                db_add_card_to_player_hand(player.id, card.name)
-                db_update_player(player)
+def process_bot_turns(room_ids: List[int]):
+    for room_id in room_ids:
+        try:
+            # Each room is its own transaction: a failing bot does not undo the others
+            with db_transaction():
+                play_bot_turn(room_id)
+        except Exception:
+            log.exception("Bot error in room %s", room_id)
+
+
+# Tournaments (see tournament.py)
+# Every batch of tables a tournament hands out is created, seated and started in
+# one transaction. Finished matches are queued and the scheduler advances them on
+# its next tick. Tournaments live in memory, like timers: after a restart only
+# their rooms are left.
+class TournamentRequest(BaseModel):
+    players: List[str]
+    table_size: int = MAX_PLAYERS  # most players at a table, see split_tables
+    first_room: int  # rooms take ids from here on, skipping ids in use
+    bots: bool = False  # seat the entrants as bots played by the server
+    seed: Optional[int] = None
+    max_turns: int = 200  # turns after which a match is decided on health, see health_winner; 0: no limit
+
+
+tournaments: Dict[int, Tournament] = {}
+_match_tournaments: Dict[int, int] = {}  # room id -> tournament of a match in play
+_finished_matches: List[Tuple[int, List[int]]] = []  # (room id, winner player ids) to advance
+_tournaments_lock = threading.Lock()  # taken after db_lock, never before it
+
+
+def match_finished(room_id: int, winners: List[int]):
+    with _tournaments_lock:
+        if _match_tournaments.get(room_id) is not None:
+            _finished_matches.append((room_id, winners))
+
+
+def match_max_turns(room_id: int) -> int:
+    """Turn limit of the tournament match played in room_id, 0 for any other room."""
+    with _tournaments_lock:
+        tournament = tournaments.get(_match_tournaments.get(room_id))
+        return tournament.max_turns if tournament is not None else 0
+
+
+def take_finished_matches() -> List[Tuple[int, List[int]]]:
+    with _tournaments_lock:
+        finished = list(_finished_matches)
+        _finished_matches.clear()
+    return finished
+
+
+def seat_tables(tournament: Tournament, tables: List[Tuple[int, List[str]]]) -> List[Match]:
+    """Create, seat and start a room per table, all in one transaction."""
+    matches = []
+    with db_transaction():
+        for round, entrants in tables:
+            room_id = tournament.next_room
+            while storage.get_room(room_id, player_ids=[]):
+                room_id += 1
+            tournament.next_room = room_id + 1
+            storage.add_room(room_id, tournament.rng.getrandbits(63))
+            room = RoomState(room_id)
+            for position, name in enumerate(entrants):
+                player = PlayerState(id=None, room_id=room_id, name=name, position=position, is_ready=True,
+                                     is_bot=tournament.bots)
+                storage.add_player(player)
+                room.players[player.id] = player
+            deal_game(room)
+            matches.append(Match(room_id, round, {p.id: p.name for p in room.players.values()}))
+
+        def register():
+            with _tournaments_lock:
+                for match in matches:
+                    tournament.matches[match.room_id] = match
+                    _match_tournaments[match.room_id] = tournament.id
+        if matches:
+            db_on_commit(("matches", matches[0].room_id), register)
+    return matches
+
+
+def advance_tournaments(finished: List[Tuple[int, List[int]]]):
+    """Move the winners of finished matches on and start the tables that can be filled."""
+    plans = []
+    with _tournaments_lock:
+        for room_id, winners in finished:
+            tournament = tournaments.get(_match_tournaments.pop(room_id, None))
+            if tournament is not None:
+                tournament.finish_match(room_id, winners)
+                if tournament not in (t for t, _ in plans):
+                    plans.append((tournament, None))
+        plans = [(tournament, tournament.next_tables()) for tournament, _ in plans]
+    for tournament, tables in plans:
+        if not tables:
+            continue
+        try:
+            seat_tables(tournament, tables)
+        except Exception:
+            with _tournaments_lock:
+                tournament.requeue(tables)
+            log.exception("Tournament %s could not seat its tables", tournament.id)
+
+
+@app.post("/tournament/{tournament_id}")
+def create_tournament(tournament_id: int, request: TournamentRequest):
+    """Register the players and start the first round, all of its tables in one transaction."""
+    if not 4 <= request.table_size <= MAX_PLAYERS:
+        raise HTTPException(status_code=400, detail=f"Размер стола должен быть от 4 до {MAX_PLAYERS}")
+    if len(request.players) < 4:
+        raise HTTPException(status_code=400, detail="Недостаточно игроков для турнира")
+    if len(set(request.players)) != len(request.players):
+        raise HTTPException(status_code=400, detail="Имена игроков должны быть уникальными")
+    if request.max_turns < 0:
+        raise HTTPException(status_code=400, detail="Лимит ходов не может быть отрицательным")
+    with _tournaments_lock:
+        if tournament_id in tournaments:
+            raise HTTPException(status_code=400, detail="Турнир уже существует")
+        tournament = tournaments[tournament_id] = Tournament(tournament_id, request.players, request.table_size,
+                                                             request.first_room, request.bots, request.seed,
+                                                             request.max_turns)
+        tables = tournament.next_tables()
+    try:
+        with write_slot(), profiler.capture("create_tournament"):
+            matches = seat_tables(tournament, tables)
+    except BaseException:
+        with _tournaments_lock:
+            del tournaments[tournament_id]
+        raise
+    return {"message": f"Турнир {tournament_id} начался", "matches": [
+        {"room_id": m.room_id, "players": [{"id": id, "name": name} for id, name in m.entrants.items()]}
+        for m in matches
+    ]}
+
+
+@app.get("/tournament/{tournament_id}")
+def get_tournament(tournament_id: int):
+    with _tournaments_lock:
+        tournament = tournaments.get(tournament_id)
+        if tournament is None:
+            raise HTTPException(status_code=404, detail="Турнир не найден")
+        report = tournament.report()
+        report["finished_queue"] = len(_finished_matches)  # matches waiting for the scheduler
+    return report
+
+
+async def run_turn_scheduler():
+    while True:
+        await asyncio.sleep(TIMER_TICK)
+        expired = timers.advance(time.monotonic())
+        if expired:
+            await run_in_threadpool(process_expired_timers, expired)
+        bot_rooms = take_bot_rooms()
+        if bot_rooms:
+            await run_in_threadpool(process_bot_turns, bot_rooms)
+        finished = take_finished_matches()
+        if finished:
+            try:
+                await run_in_threadpool(advance_tournaments, finished)
+            except Exception:
+                log.exception("Tournament scheduler error")
+
+
+def hydrate_rooms():
+    """Load every stored room with one pass over each table.
+
+    Piles of running games go straight into the cache, so the first action in a
+    room after a restart only loads its players. Timers are not persisted: every
+    room gets a fresh idle timer and turn, and its bots are woken.
+    """
+    with db_lock:
+        rooms, decks, discards = storage.load_rooms()
+        for room_id, game_started, winner, current_player_id, current_is_bot, players in rooms:
+            touch_room(room_id)
+            if winner is not None:
+                continue
+            if game_started:
+                _room_piles[room_id] = RoomPiles(decks.get(room_id, array("H")), discards.get(room_id, array("H")))
+                timers.arm(("turn", room_id), TURN_TIMEOUT, current_player_id)
+                if current_is_bot:
+                    queue_bot_turn(room_id)
             else:
-                break #No more card possible to add
+                open_rooms.update(room_id, players, False)
+
+
+def warm_up():
+    """Open the storage and load up front what first requests would load one at a time."""
+    storage.open()
+    hydrate_rooms()
+    game_stats.load(storage.load_stats())
+
+
+def start_turn_scheduler():
+    global _scheduler_task
+    _scheduler_task = asyncio.create_task(run_turn_scheduler())
+
+
+def stop_turn_scheduler():
+    if _scheduler_task:
+        _scheduler_task.cancel()
@@ -0,0 +1,213 @@
+"""On-demand profiling of live requests.
+
+An admin arms a ProfileSession for the next N matching requests and request
+handlers wrap their work in Profiler.capture(). Profiling follows the thread
+that runs the handler, so one request is captured at a time: requests that
+arrive while another one is being captured run unprofiled and are not counted.
+
+Modes:
+    cprofile     deterministic profile of every call (cProfile)
+    sample       stacks of the captured thread sampled every `interval` seconds
+                 by one sampler thread per session; short requests get a sample
+                 now and then, so use it over many requests
+    tracemalloc  memory still allocated at the end of the request, by line
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+
+MODES = ("cprofile", "sample", "tracemalloc")
+TOP = 30  # entries per report list
+
+
+def _where(code) -> str:
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+class ProfileSession:
+    def __init__(self, mode: str, requests: int, route: Optional[str] = None, action: Optional[str] = None,
+                 card: Optional[str] = None, interval: float = 0.001):
+        if mode not in MODES:
+            raise ValueError(f"unknown profiling mode {mode!r}")
+        self.mode = mode
+        self.requests = requests
+        self.route = route
+        self.action = action
+        self.card = card
+        self.interval = interval
+        self.captured = 0
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.saved_to: Optional[str] = None
+        self.profiles: List[cProfile.Profile] = []  # cprofile
+        self.samples = 0  # sample
+        self.self_samples: Counter = Counter()  # function -> samples at the top of the stack
+        self.stack_samples: Counter = Counter()  # function -> samples anywhere on the stack
+        self.allocated: Counter = Counter()  # tracemalloc: line -> bytes
+        self.allocations: Counter = Counter()  # line -> blocks
+
+    @property
+    def done(self) -> bool:
+        return self.captured >= self.requests
+
+    def matches(self, route: str, action: Optional[str], card: Optional[str]) -> bool:
+        return ((self.route is None or self.route == route)
+                and (self.action is None or self.action == action)
+                and (self.card is None or self.card == card))
+
+    def _stats(self) -> Optional[pstats.Stats]:
+        if not self.profiles:
+            return None
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def report(self) -> dict:
+        report = {
+            "mode": self.mode,
+            "filters": {"route": self.route, "action": self.action, "card": self.card},
+            "requests": self.requests,
+            "captured": self.captured,
+            "started": self.started,
+            "finished": self.finished,
+            "saved_to": self.saved_to,
+        }
+        if self.mode == "cprofile":
+            stats = self._stats()
+            rows = []
+            if stats:
+                for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+                    rows.append({"function": f"{filename}:{line}({name})", "calls": calls,
+                                 "tottime_ms": round(tottime * 1000, 3), "cumtime_ms": round(cumtime * 1000, 3)})
+                rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+            report["functions"] = rows[:TOP]
+        elif self.mode == "sample":
+            report["samples"] = self.samples
+            report["interval"] = self.interval
+            report["self"] = [{"function": f, "samples": n} for f, n in self.self_samples.most_common(TOP)]
+            report["cumulative"] = [{"function": f, "samples": n} for f, n in self.stack_samples.most_common(TOP)]
+        else:
+            report["allocations"] = [{"line": line, "kib": round(size / 1024, 1), "blocks": self.allocations[line]}
+                                     for line, size in self.allocated.most_common(TOP)]
+        return report
+
+    def save(self, directory: str):
+        """Write the session to directory: a .prof file for cprofile, JSON otherwise."""
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.join(directory, f"profile-{int(self.started)}-{self.mode}")
+        stats = self._stats() if self.mode == "cprofile" else None
+        if stats:
+            self.saved_to = name + ".prof"
+            stats.dump_stats(self.saved_to)
+        else:
+            self.saved_to = name + ".json"
+            with open(self.saved_to, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, ensure_ascii=False, indent=1)
+
+
+class Profiler:
+    """Holds the armed session (at most one) and the last finished one."""
+
+    def __init__(self, save_dir: Optional[str] = None):
+        self.save_dir = save_dir
+        self.session: Optional[ProfileSession] = None
+        self.last: Optional[ProfileSession] = None
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()  # held while a request is captured
+        self._sampled_thread: Optional[int] = None  # thread captured in sample mode
+        self._sampler_stop: Optional[threading.Event] = None
+        self._switch_interval = sys.getswitchinterval()
+
+    def start(self, session: ProfileSession):
+        self.stop()
+        with self._lock:
+            if session.mode == "tracemalloc" and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif session.mode == "sample":
+                # Let the sampler take the GIL about as often as it wants to sample
+                self._switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._switch_interval, session.interval))
+                self._sampler_stop = threading.Event()
+                threading.Thread(target=self._sample, args=(session, self._sampler_stop), name="profile-sampler",
+                                 daemon=True).start()
+            self.session = session
+
+    def stop(self) -> Optional[ProfileSession]:
+        """Finish the armed session, keeping what it captured so far."""
+        with self._lock:
+            session, self.session = self.session, None
+            if session is None:
+                return None
+            session.finished = time.time()
+            if session.mode == "tracemalloc" and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            elif session.mode == "sample":
+                self._sampler_stop.set()
+                sys.setswitchinterval(self._switch_interval)
+            self.last = session
+        if self.save_dir:
+            session.save(self.save_dir)
+        return session
+
+    @contextmanager
+    def capture(self, route: str, action: Optional[str] = None, card: Optional[str] = None):
+        session = self.session
+        if (session is None or session.done or not session.matches(route, action, card)
+                or not self._busy.acquire(blocking=False)):
+            yield
+            return
+        try:
+            if session.mode == "cprofile":
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    yield
+                finally:
+                    profile.disable()
+                    session.profiles.append(profile)
+            elif session.mode == "sample":
+                self._sampled_thread = threading.get_ident()
+                try:
+                    yield
+                finally:
+                    self._sampled_thread = None
+            else:
+                before = tracemalloc.take_snapshot()
+                try:
+                    yield
+                finally:
+                    after = tracemalloc.take_snapshot()
+                    for stat in after.compare_to(before, "lineno"):
+                        if stat.size_diff > 0:
+                            frame = stat.traceback[0]
+                            line = f"{frame.filename}:{frame.lineno}"
+                            session.allocated[line] += stat.size_diff
+                            session.allocations[line] += max(stat.count_diff, 0)
+        finally:
+            session.captured += 1
+            self._busy.release()
+            if session.done and self.session is session:
+                self.stop()
+
+    def _sample(self, session: ProfileSession, stopped: threading.Event):
+        while not stopped.wait(session.interval):
+            thread_id = self._sampled_thread
+            frame = sys._current_frames().get(thread_id) if thread_id is not None else None
+            if frame is None:
+                continue
+            session.samples += 1
+            session.self_samples[_where(frame.f_code)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(_where(frame.f_code))
+                frame = frame.f_back
+            session.stack_samples.update(seen)
@@ -0,0 +1,111 @@
+"""Admission control: keyed token buckets and a concurrency gate.
+
+RateLimiter keeps one token bucket per key (a player, a room), refilled lazily
+on access, so an idle key costs nothing until it is swept. WriteGate lets at
+most `limit` callers in at once, queues up to `max_queue` more for at most
+`timeout` seconds and sheds the rest immediately. Both raise Rejected with the
+number of seconds after which a retry can succeed, and count what they did.
+"""
+import math
+import threading
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))  # whole seconds, as HTTP wants
+
+
+def parse_rate(spec: str) -> Optional[Tuple[float, float]]:
+    """Parse RATE/BURST (tokens per second, bucket size); a bare RATE bursts one second, 0 disables."""
+    rate, _, burst = spec.partition("/")
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: float, burst: float, max_keys: int = 100_000):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.admitted = 0
+        self.rejected = 0
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}  # key -> (tokens, refilled at)
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable, now: Optional[float] = None):
+        """Take a token for key or raise Rejected."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+            if tokens < 1.0:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                raise Rejected(self.name, (1.0 - tokens) / self.rate)
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                self._sweep(now)
+            self._buckets[key] = (tokens - 1.0, now)
+            self.admitted += 1
+
+    def _sweep(self, now: float):
+        # A bucket that has refilled is the same as no bucket
+        self._buckets = {key: (tokens, stamp) for key, (tokens, stamp) in self._buckets.items()
+                         if tokens + (now - stamp) * self.rate < self.burst}
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "keys": len(self._buckets),
+                "admitted": self.admitted, "rejected": self.rejected}
+
+
+class WriteGate:
+    def __init__(self, limit: int, max_queue: int, timeout: float = 5.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.shed = 0  # rejected because the queue was full
+        self.timed_out = 0  # rejected after waiting for timeout
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if there is room in it, or raise Rejected."""
+        with self._cond:
+            if self.active >= self.limit:
+                if self.queued >= self.max_queue:
+                    self.shed += 1
+                    raise Rejected("queue", self.timeout)
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < self.limit, self.timeout)
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    self.timed_out += 1
+                    raise Rejected("timeout", self.timeout)
+            self.active += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "max_queue": self.max_queue, "active": self.active, "queued": self.queued,
+                "peak_queued": self.peak_queued, "admitted": self.admitted, "shed": self.shed,
+                "timed_out": self.timed_out}
@@ -0,0 +1,88 @@
+"""Replay recorded room traces against the engine and report per-action latency.
+
+Traces are the JSON documents served by GET /room/{room_id}/trace (an admin
+route) of a server running with BANG_RECORD_ACTIONS=1. Each trace is replayed in
+a throwaway database: the room is recreated with the recorded seed, the seats are
+filled in order (bot seats are replayed as ordinary players), the game is started
+and the recorded actions are applied in-process, back to back.
+
+    python replay.py traces/*.json --repeat 5
+
+Exits with status 1 when a replayed action fails or returns something else than
+was recorded, i.e. when the engine no longer plays the game the same way.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from loadgen import percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="+", help="trace files from GET /room/{room_id}/trace")
+    parser.add_argument("--repeat", type=int, default=1, help="replays of every trace")
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix="bang-replay-")
+    os.environ["BANG_DATABASE_URL"] = os.path.join(db_dir, "replay.db")
+    os.environ["BANG_RECORD_ACTIONS"] = "0"
+    os.environ["BANG_PLAYER_ACTION_RATE"] = os.environ["BANG_ROOM_ACTION_RATE"] = "0"  # actions back to back
+    import main as game
+    from fastapi import HTTPException
+    game.warm_up()
+
+    traces = []
+    for path in args.traces:
+        with open(path, encoding="utf-8") as f:
+            traces.append((path, json.load(f)))
+
+    next_room = iter(range(1, 10 ** 9))
+    samples = defaultdict(list)  # action (play_card per card) -> ms
+    mismatches = 0
+
+    for _ in range(args.repeat):
+        for path, trace in traces:
+            room_id = next(next_room)
+            game.open_room(room_id, seed=trace["seed"])
+            ids = {}  # recorded player id -> replayed player id
+            for seat in trace["players"]:
+                ids[seat["id"]] = game.add_player(room_id, seat["name"])["player_id"]
+                game.set_ready(room_id, ids[seat["id"]])
+            game.start_game(room_id)
+
+            for seq, recorded in enumerate(trace["actions"]):
+                target = recorded["target_player_id"]
+                action = game.PlayerAction(player_id=ids[recorded["player_id"]], action=recorded["action"],
+                                           card_name=recorded["card_name"],
+                                           target_player_id=ids.get(target, target))
+                started = time.perf_counter()
+                try:
+                    result = game.player_action(room_id, action)
+                except HTTPException as e:
+                    result = {"error": e.detail}
+                elapsed = (time.perf_counter() - started) * 1000
+                key = action.action if action.action != "play_card" else f"play_card {action.card_name}"
+                samples[key].append(elapsed)
+                if result != recorded["result"]:
+                    mismatches += 1
+                    print(f"{path}: action {seq} ({key}) returned {result}, recorded {recorded['result']}")
+
+    print(f"{'action':<28} {'count':>6} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for key in sorted(samples):
+        values = samples[key]
+        print(f"{key:<28} {len(values):>6} {statistics.mean(values):>8.3f} {percentile(values, 0.5):>7.3f} "
+              f"{percentile(values, 0.95):>7.3f} {percentile(values, 0.99):>7.3f}")
+    total = sum(len(values) for values in samples.values())
+    print(f"replayed {total} actions from {len(traces)} traces x {args.repeat}: "
+          f"{'ok' if not mismatches else f'{mismatches} mismatches'}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
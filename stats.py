@@ -0,0 +1,84 @@
+"""Game statistics kept as running totals.
+
+Every counter is a (metric, key) pair holding a count and a total: ("card",
+"Гатлинг") counts the plays of a card and sums the damage they did, ("role",
+"шериф") counts finished games with a sheriff and sums their wins. The engine
+adds the deltas of an action or of a finished game inside its transaction; the
+storage upserts them into one small table and GameStats merges them into memory
+once committed. Reports read only memory: a bounded number of counters, never
+the game tables, so statistics do not compete with the games for the database.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+HOUR = 3600
+
+# (metric, key) -> (count, total)
+Deltas = Dict[Tuple[str, str], Tuple[int, float]]
+
+
+def add_delta(deltas: Deltas, metric: str, key: str, count: int = 1, total: float = 0.0):
+    old_count, old_total = deltas.get((metric, key), (0, 0.0))
+    deltas[(metric, key)] = (old_count + count, old_total + total)
+
+
+def hour_key(timestamp: float) -> str:
+    return str(int(timestamp // HOUR))
+
+
+class GameStats:
+    def __init__(self, window_hours: int = 24):
+        self.window_hours = window_hours
+        self._totals: Dict[str, Dict[str, List[float]]] = {}  # metric -> key -> [count, total]
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[str, str, int, float]]):
+        """Replace the totals with stored (metric, key, count, total) rows."""
+        with self._lock:
+            self._totals = {}
+            for metric, key, count, total in rows:
+                self._totals.setdefault(metric, {})[key] = [count, total]
+
+    def merge(self, deltas: Deltas):
+        with self._lock:
+            for (metric, key), (count, total) in deltas.items():
+                counter = self._totals.setdefault(metric, {}).setdefault(key, [0, 0.0])
+                counter[0] += count
+                counter[1] += total
+
+    def _get(self, metric: str, key: str) -> Tuple[int, float]:
+        count, total = self._totals.get(metric, {}).get(key, (0, 0.0))
+        return count, total
+
+    def report(self, now: float = None) -> dict:
+        now = time.time() if now is None else now
+        with self._lock:
+            started, _ = self._get("games", "started")
+            finished, length = self._get("games", "finished")
+            current = int(now // HOUR)
+            hours = []
+            for hour in range(current - self.window_hours + 1, current + 1):
+                hours.append({"hour": hour * HOUR, "started": self._get("started", str(hour))[0],
+                              "finished": self._get("finished", str(hour))[0]})
+            roles = {role: {"games": count, "wins": int(wins), "win_rate": round(wins / count, 3)}
+                     for role, (count, wins) in self._totals.get("role", {}).items() if count}
+            plays = sum(count for count, _ in self._totals.get("card", {}).values())
+            cards = {name: {"plays": count, "share": round(count / plays, 3), "damage": int(damage),
+                            "damage_per_play": round(damage / count, 3)}
+                     for name, (count, damage) in self._totals.get("card", {}).items() if count}
+            actions = {action: {"count": count, "damage": int(damage)}
+                       for action, (count, damage) in self._totals.get("action", {}).items()}
+            sides = {side: int(count) for side, (count, _) in self._totals.get("side", {}).items()}
+        window = sum(hour["finished"] for hour in hours)
+        return {
+            "games_started": int(started),
+            "games_finished": int(finished),
+            "games_per_hour": round(window / self.window_hours, 2),  # finished, over the window
+            "average_game_seconds": round(length / finished, 1) if finished else None,
+            "hours": hours,
+            "wins_by_side": sides,
+            "roles": roles,
+            "cards": cards,
+            "actions": actions,
+        }
@@ -0,0 +1,874 @@
+"""Storage backends for the game state.
+
+The engine (main.py) reaches rooms, players, hands, piles and action traces only
+through a Storage, chosen at startup with BANG_STORAGE:
+
+    sqlite  SqliteStorage, the durable default (file in BANG_DATABASE_URL)
+    memory  MemoryStorage, plain dictionaries for simulations, tests and benchmarks
+
+The engine writes inside db_transaction(), which holds Storage.lock and ends
+with commit() or rollback(); backends never commit on their own. snapshot()
+yields a consistent read-only view for the query endpoints. Another backend
+(e.g. a key-value store) implements the methods of Storage.
+
+Backends touch nothing when created: open() connects and prepares the schema at
+startup, and load_rooms() hands the engine every stored room in one pass.
+"""
+import queue
+import sqlite3
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from domain import CARD_KIND, CARD_NAMES, PlayerState, RoomState, card_suit, card_value, parse_permanent_effects
+from stats import Deltas
+
+# Version of the SQLite schema, kept in PRAGMA user_version. Bump it when the tables
+# or the card catalog change, so that open() migrates the database once.
+SCHEMA_VERSION = 4
+
+PLAYER_COLUMNS = ("id, room_id, name, hp, max_hp, role, is_alive, is_ready, position, weapon, permanent_effects, "
+                  "is_bot")
+
+# (seed, seats, actions) of a room: seats are (id, name, is_bot) by position, actions are
+# (player_id, action, card_name, target_player_id, result JSON) in order
+Trace = Tuple[Optional[int], List[Tuple[int, str, bool]], List[Tuple[int, str, Optional[str], Optional[int], str]]]
+
+# (rooms, decks, discards) of every stored room: rooms are (room_id, game_started, winner,
+# current_player_id, current_is_bot, players), piles are card ids of games in play by room
+StoredRooms = Tuple[List[Tuple[int, bool, Optional[str], Optional[int], bool, int]], Dict[int, array],
+                    Dict[int, array]]
+
+
+def player_from_row(row, hand: Optional[array]) -> PlayerState:
+    id, room_id, name, hp, max_hp, role, is_alive, is_ready, position, weapon, permanent_effects_str, is_bot = row
+    return PlayerState(id, room_id, name, hp, max_hp, hand, role, bool(is_alive), bool(is_ready), position, weapon,
+                       parse_permanent_effects(permanent_effects_str), bool(is_bot))
+
+
+def player_row(player: PlayerState) -> tuple:
+    """Row of a player in PLAYER_COLUMNS order."""
+    return (player.id, player.room_id, player.name, player.hp, player.max_hp, player.role, int(player.is_alive),
+            int(player.is_ready), player.position, player.weapon,
+            str(player.permanent_effects), int(player.is_bot))  # Store permanent_effects as string
+
+
+class Storage:
+    """Interface of a storage backend."""
+
+    lock: threading.RLock  # held by the engine around every transaction
+
+    def open(self):
+        """Connect and prepare the schema; called once at startup, before any other method."""
+
+    def close(self):
+        pass
+
+    # Reads; the first three are also available on snapshot()
+    def get_room(self, room_id: int, player_ids: Optional[List[int]] = None) -> Optional[RoomState]:
+        """A room with all of its players, or only with player_ids when given."""
+        raise NotImplementedError
+
+    def count_deck(self, room_id: int) -> int:
+        raise NotImplementedError
+
+    def get_trace(self, room_id: int) -> Optional[Trace]:
+        raise NotImplementedError
+
+    def get_player(self, player_id: int) -> Optional[PlayerState]:
+        raise NotImplementedError
+
+    def get_deck(self, room_id: int) -> array:
+        raise NotImplementedError
+
+    def get_discard(self, room_id: int) -> array:
+        raise NotImplementedError
+
+    def load_rooms(self) -> StoredRooms:
+        """Every stored room at startup, reading each table once."""
+        raise NotImplementedError
+
+    def load_stats(self) -> List[Tuple[str, str, int, float]]:
+        """Every (metric, key, count, total) counter, see stats.py."""
+        raise NotImplementedError
+
+    # Writes
+    def add_room(self, room_id: int, seed: int):
+        raise NotImplementedError
+
+    def update_room(self, room: RoomState):
+        raise NotImplementedError
+
+    def delete_room(self, room_id: int):
+        """Remove a room with its players, hands, piles and trace."""
+        raise NotImplementedError
+
+    def next_rng_step(self, room_id: int) -> Tuple[int, int]:
+        """Advance the random step of a room; returns (seed, step)."""
+        raise NotImplementedError
+
+    def add_player(self, player: PlayerState) -> int:
+        """Insert a player; a missing id is assigned by the backend. Returns the id."""
+        raise NotImplementedError
+
+    def update_player(self, player: PlayerState):
+        raise NotImplementedError
+
+    def update_players(self, players: List[PlayerState]):
+        """Write hp, is_alive, weapon and permanent effects of several players."""
+        raise NotImplementedError
+
+    def add_to_hand(self, player_id: int, card_id: int):
+        raise NotImplementedError
+
+    def remove_from_hand(self, player_id: int, card_id: int):
+        raise NotImplementedError
+
+    def update_hands(self, removed: List[Tuple[int, int]], added: List[Tuple[int, int]]):
+        """Remove and then append (player id, card id) pairs."""
+        raise NotImplementedError
+
+    def setup_game(self, room: RoomState, deck: array):
+        """Write roles, dealt hands, the deck, an empty discard pile and the room."""
+        raise NotImplementedError
+
+    def truncate_deck(self, room_id: int, size: int):
+        """Drop the cards above position size (drawn from the top)."""
+        raise NotImplementedError
+
+    def append_discard(self, room_id: int, start: int, card_ids: List[int]):
+        """Put card_ids on the discard pile at positions start, start + 1, ..."""
+        raise NotImplementedError
+
+    def replace_piles(self, room_id: int, deck: array, discard: array):
+        raise NotImplementedError
+
+    def record_action(self, room_id: int, player_id: int, action: str, card_name: Optional[str],
+                      target_player_id: Optional[int], result: str):
+        raise NotImplementedError
+
+    def add_stats(self, deltas: Deltas):
+        """Add counts and totals to the stats counters, creating missing ones."""
+        raise NotImplementedError
+
+    # Transactions
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def snapshot(self):
+        raise NotImplementedError
+        yield
+
+
+class SqliteReads(Storage):
+    """Reads of SqliteStorage against one cursor, shared with its snapshots."""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self.cursor = cursor
+
+    def get_room(self, room_id: int, player_ids: Optional[List[int]] = None) -> Optional[RoomState]:
+        cur = self.cursor
+        cur.execute("""
+            SELECT id, game_started, current_player_id, roles_assigned, winner, started_at, turn,
+                   (SELECT COUNT(*) FROM players WHERE room_id = game_rooms.id)
+            FROM game_rooms WHERE id = ?
+        """, (room_id,))
+        row = cur.fetchone()
+        if row:
+            id, game_started, current_player_id, roles_assigned, winner, started_at, turn, seats = row
+            # Fetch players with their hands in two queries
+            if player_ids is None:
+                cur.execute(f"SELECT {PLAYER_COLUMNS} FROM players WHERE room_id = ? ORDER BY position", (id,))
+                player_rows = cur.fetchall()
+                cur.execute("""
+                    SELECT player_id, card_id FROM player_hands
+                    WHERE player_id IN (SELECT id FROM players WHERE room_id = ?) ORDER BY rowid
+                """, (id,))
+            else:
+                marks = ", ".join("?" * len(player_ids))
+                cur.execute(f"""
+                    SELECT {PLAYER_COLUMNS} FROM players WHERE room_id = ? AND id IN ({marks}) ORDER BY position
+                """, (id, *player_ids))
+                player_rows = cur.fetchall()
+                cur.execute(f"""
+                    SELECT player_id, card_id FROM player_hands
+                    WHERE player_id IN (SELECT id FROM players WHERE room_id = ? AND id IN ({marks})) ORDER BY rowid
+                """, (id, *player_ids))
+            hands: Dict[int, array] = {}
+            for player_id, card_id in cur.fetchall():
+                hand = hands.get(player_id)
+                if hand is None:
+                    hand = hands[player_id] = array("H")
+                hand.append(card_id)
+            players = {}
+            for player_row in player_rows:
+                players[player_row[0]] = player_from_row(player_row, hands.get(player_row[0]))
+
+            return RoomState(id=id, players=players, game_started=bool(game_started),
+                             current_player_id=current_player_id, roles_assigned=bool(roles_assigned), seats=seats,
+                             winner=winner, started_at=started_at, turn=turn)
+        return None
+
+    def count_deck(self, room_id: int) -> int:
+        self.cursor.execute("SELECT COUNT(*) FROM deck WHERE room_id = ?", (room_id,))
+        return self.cursor.fetchone()[0]
+
+    def get_trace(self, room_id: int) -> Optional[Trace]:
+        cur = self.cursor
+        cur.execute("SELECT seed FROM game_rooms WHERE id = ?", (room_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        cur.execute("SELECT id, name, is_bot FROM players WHERE room_id = ? ORDER BY position", (room_id,))
+        seats = [(id, name, bool(is_bot)) for id, name, is_bot in cur.fetchall()]
+        cur.execute("""
+            SELECT player_id, action, card_name, target_player_id, result FROM action_trace
+            WHERE room_id = ? ORDER BY seq
+        """, (room_id,))
+        return row[0], seats, cur.fetchall()
+
+
+class SqliteSnapshot(SqliteReads):
+    pass
+
+
+class ReadPool:
+    """Read-only connections for snapshots; each snapshot runs in its own read transaction."""
+
+    def __init__(self, database: str, size: int):
+        self.database = database
+        self.size = size if database != ":memory:" else 0
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        read_conn = sqlite3.connect(f"file:{self.database}?mode=ro", uri=True, check_same_thread=False)
+        read_conn.isolation_level = None  # BEGIN/COMMIT are issued explicitly
+        return read_conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+    @contextmanager
+    def cursor(self):
+        read_conn = self._acquire()
+        try:
+            read_cursor = read_conn.cursor()
+            read_cursor.execute("BEGIN")
+            try:
+                yield read_cursor
+            finally:
+                read_cursor.execute("COMMIT")
+        finally:
+            self._idle.put(read_conn)
+
+
+class SqliteStorage(SqliteReads):
+    """Game state in an SQLite file, written by one connection.
+
+    WAL lets the read-only connections of the ReadPool read a consistent
+    snapshot while a write transaction is in progress. With no pool (size 0 or
+    an in-memory database) snapshots read through the writer under the lock.
+    """
+
+    def __init__(self, database: str, read_pool_size: int = 4):
+        super().__init__(None)
+        self.database = database
+        self.lock = threading.RLock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.read_pool = ReadPool(database, read_pool_size)
+
+    def open(self):
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        if self.database != ":memory:":
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            self.cursor.execute("PRAGMA synchronous=NORMAL")
+        # An up to date database is used as is; DDL and the catalog run once per version
+        self.cursor.execute("PRAGMA user_version")
+        if self.cursor.fetchone()[0] < SCHEMA_VERSION:
+            self._create_schema()
+            self.conn.commit()
+            self._seed_cards()
+            self._migrate_card_names()
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.conn.commit()
+
+    def close(self):
+        self.read_pool.close()
+        self.conn.close()
+
+    def _columns(self, table: str) -> List[str]:
+        self.cursor.execute(f"PRAGMA table_info({table})")
+        return [row[1] for row in self.cursor.fetchall()]
+
+    def _create_schema(self):
+        cur = self.cursor
+
+        # The first layout kept no room_id on players and used card names as primary keys
+        # in deck/hands/discard, so a room could not hold two "Бэнг". Game state is
+        # transient, so old tables are simply recreated.
+        if self._columns("players") and "room_id" not in self._columns("players"):
+            for table in ("players", "player_hands", "deck", "discard_pile"):
+                cur.execute(f"DROP TABLE IF EXISTS {table}")
+
+        # Cards used to be keyed and referenced by name. The catalog is reseeded; piles
+        # and hands are kept aside and converted to card ids by migrate_card_names().
+        if self._columns("cards") and "id" not in self._columns("cards"):
+            cur.execute("DROP TABLE cards")
+        if "card_name" in self._columns("deck"):
+            for table in ("player_hands", "deck", "discard_pile"):
+                cur.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+
+        # Create tables (if they don't exist)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY,  -- card id, see CARD_NAMES
+            name TEXT,
+            suit TEXT,
+            value INTEGER
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            room_id INTEGER,
+            name TEXT,
+            hp INTEGER DEFAULT 4,
+            max_hp INTEGER DEFAULT 5,
+            role TEXT,
+            is_alive INTEGER DEFAULT 1,  -- 1 for True, 0 for False
+            is_ready INTEGER DEFAULT 0,
+            position INTEGER DEFAULT 0,
+            weapon TEXT DEFAULT 'Кольт',
+            permanent_effects TEXT DEFAULT '[]',
+            is_bot INTEGER DEFAULT 0,  -- played by the server, see play_bot_turn
+            FOREIGN KEY (room_id) REFERENCES game_rooms(id)
+        )
+        """)
+        if "is_bot" not in self._columns("players"):
+            cur.execute("ALTER TABLE players ADD COLUMN is_bot INTEGER DEFAULT 0")
+        cur.execute("CREATE INDEX IF NOT EXISTS players_room ON players (room_id, position)")
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS game_rooms (
+            id INTEGER PRIMARY KEY,
+            game_started INTEGER DEFAULT 0,
+            current_player_id INTEGER,
+            roles_assigned INTEGER DEFAULT 0,
+            seed INTEGER,  -- see room_rng
+            rng_step INTEGER DEFAULT 0,
+            winner TEXT,  -- side that won, see end_game_if_over
+            started_at REAL,  -- unix time the game was dealt
+            turn INTEGER DEFAULT 0  -- turns passed, see match_max_turns in main.py
+        )
+        """)
+        for column, definition in (("seed", "INTEGER"), ("rng_step", "INTEGER DEFAULT 0"), ("winner", "TEXT"),
+                                   ("started_at", "REAL"), ("turn", "INTEGER DEFAULT 0")):
+            if column not in self._columns("game_rooms"):
+                cur.execute(f"ALTER TABLE game_rooms ADD COLUMN {column} {definition}")
+
+        # Hand order is the rowid order
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS player_hands (
+            player_id INTEGER,
+            card_id INTEGER,
+            FOREIGN KEY (player_id) REFERENCES players(id),
+            FOREIGN KEY (card_id) REFERENCES cards(id),
+            PRIMARY KEY (player_id, card_id)
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS deck (
+            room_id INTEGER,
+            card_id INTEGER,
+            position INTEGER,  -- Order in the deck
+            FOREIGN KEY (room_id) REFERENCES game_rooms(id),
+            FOREIGN KEY (card_id) REFERENCES cards(id),
+            PRIMARY KEY (room_id, position)
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS discard_pile (
+            room_id INTEGER,
+            card_id INTEGER,
+            position INTEGER,  -- Order of discarding
+            FOREIGN KEY (room_id) REFERENCES game_rooms(id),
+            FOREIGN KEY (card_id) REFERENCES cards(id),
+            PRIMARY KEY (room_id, position)
+        )
+        """)
+
+        # Successful actions of a room in order, with their results (replay.py input)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS action_trace (
+            room_id INTEGER,
+            seq INTEGER,
+            player_id INTEGER,
+            action TEXT,
+            card_name TEXT,
+            target_player_id INTEGER,
+            result TEXT,  -- JSON
+            FOREIGN KEY (room_id) REFERENCES game_rooms(id),
+            PRIMARY KEY (room_id, seq)
+        )
+        """)
+
+        # Running totals of the game statistics, see stats.py
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS game_stats (
+            metric TEXT,
+            key TEXT,
+            count INTEGER DEFAULT 0,
+            total REAL DEFAULT 0,
+            PRIMARY KEY (metric, key)
+        ) WITHOUT ROWID
+        """)
+
+    def _seed_cards(self):
+        """Write the card catalog once; existing rows are kept."""
+        self.cursor.executemany("INSERT OR IGNORE INTO cards (id, name, suit, value) VALUES (?, ?, ?, ?)",
+                                [(card_id, CARD_NAMES[card_id], card_suit(card_id), card_value(card_id))
+                                 for card_id in range(len(CARD_KIND))])
+
+    def _migrate_card_names(self):
+        """Convert piles and hands stored by card name (legacy_* tables) to card ids."""
+        if "card_name" not in self._columns("legacy_deck"):
+            return
+        free_ids: Dict[int, Dict[str, List[int]]] = {}  # room -> name -> unused card ids
+
+        def take_id(room_id: int, name: str) -> Optional[int]:
+            if room_id not in free_ids:
+                free_ids[room_id] = {}
+                for card_id in reversed(range(len(CARD_KIND))):
+                    free_ids[room_id].setdefault(CARD_NAMES[card_id], []).append(card_id)
+            ids = free_ids[room_id].get(name)
+            return ids.pop() if ids else None
+
+        for table in ("deck", "discard_pile"):
+            self.cursor.execute(f"SELECT room_id, card_name, position FROM legacy_{table} ORDER BY room_id, position")
+            rows = [(room_id, take_id(room_id, name), position)
+                    for room_id, name, position in self.cursor.fetchall()]
+            self.cursor.executemany(f"INSERT INTO {table} (room_id, card_id, position) VALUES (?, ?, ?)",
+                                    [row for row in rows if row[1] is not None])
+        self.cursor.execute("""
+            SELECT players.room_id, legacy_player_hands.player_id, legacy_player_hands.card_name
+            FROM legacy_player_hands JOIN players ON players.id = legacy_player_hands.player_id
+            ORDER BY legacy_player_hands.rowid
+        """)
+        rows = [(player_id, take_id(room_id, name)) for room_id, player_id, name in self.cursor.fetchall()]
+        self.cursor.executemany("INSERT INTO player_hands (player_id, card_id) VALUES (?, ?)",
+                                [row for row in rows if row[1] is not None])
+        for table in ("player_hands", "deck", "discard_pile"):
+            self.cursor.execute(f"DROP TABLE legacy_{table}")
+
+    # Reads for the writer
+    def get_hand(self, player_id: int) -> array:
+        self.cursor.execute("SELECT card_id FROM player_hands WHERE player_id = ? ORDER BY rowid", (player_id,))
+        return array("H", [row[0] for row in self.cursor.fetchall()])
+
+    def get_player(self, player_id: int) -> Optional[PlayerState]:
+        self.cursor.execute(f"SELECT {PLAYER_COLUMNS} FROM players WHERE id = ?", (player_id,))
+        row = self.cursor.fetchone()
+        if row:
+            return player_from_row(row, self.get_hand(player_id))
+        return None
+
+    def get_deck(self, room_id: int) -> array:
+        self.cursor.execute("SELECT card_id FROM deck WHERE room_id = ? ORDER BY position", (room_id,))
+        return array("H", [row[0] for row in self.cursor.fetchall()])
+
+    def get_discard(self, room_id: int) -> array:
+        self.cursor.execute("SELECT card_id FROM discard_pile WHERE room_id = ? ORDER BY position", (room_id,))
+        return array("H", [row[0] for row in self.cursor.fetchall()])
+
+    def load_rooms(self) -> StoredRooms:
+        cur = self.cursor
+        cur.execute("SELECT id, room_id, is_bot FROM players")
+        seated: Dict[int, int] = {}
+        bots = set()
+        for player_id, room_id, is_bot in cur.fetchall():
+            seated[room_id] = seated.get(room_id, 0) + 1
+            if is_bot:
+                bots.add(player_id)
+        cur.execute("SELECT id, game_started, winner, current_player_id FROM game_rooms")
+        rooms = [(room_id, bool(game_started), winner, current_player_id, current_player_id in bots,
+                  seated.get(room_id, 0))
+                 for room_id, game_started, winner, current_player_id in cur.fetchall()]
+        started = {room[0] for room in rooms if room[1] and room[2] is None}
+        piles = []
+        for table in ("deck", "discard_pile"):
+            # Primary key order: one pass over the index, no sort
+            cur.execute(f"SELECT room_id, card_id FROM {table} ORDER BY room_id, position")
+            pile: Dict[int, array] = {}
+            for room_id, card_id in cur.fetchall():
+                if room_id in started:
+                    cards = pile.get(room_id)
+                    if cards is None:
+                        cards = pile[room_id] = array("H")
+                    cards.append(card_id)
+            piles.append(pile)
+        return rooms, piles[0], piles[1]
+
+    def load_stats(self) -> List[Tuple[str, str, int, float]]:
+        self.cursor.execute("SELECT metric, key, count, total FROM game_stats")
+        return self.cursor.fetchall()
+
+    # Writes
+    def add_room(self, room_id: int, seed: int):
+        self.cursor.execute("""
+            INSERT INTO game_rooms (id, game_started, current_player_id, roles_assigned, seed) VALUES (?, ?, ?, ?, ?)
+        """, (room_id, 0, None, 0, seed))
+
+    def update_room(self, room: RoomState):
+        self.cursor.execute("""
+            UPDATE game_rooms SET game_started=?, current_player_id=?, roles_assigned=?, winner=?, started_at=?, turn=?
+            WHERE id=?
+        """, (int(room.game_started), room.current_player_id, int(room.roles_assigned), room.winner,
+              room.started_at, room.turn, room.id))
+
+    def delete_room(self, room_id: int):
+        cur = self.cursor
+        cur.execute("DELETE FROM player_hands WHERE player_id IN (SELECT id FROM players WHERE room_id=?)",
+                    (room_id,))
+        cur.execute("DELETE FROM players WHERE room_id=?", (room_id,))
+        cur.execute("DELETE FROM deck WHERE room_id=?", (room_id,))
+        cur.execute("DELETE FROM discard_pile WHERE room_id=?", (room_id,))
+        cur.execute("DELETE FROM action_trace WHERE room_id=?", (room_id,))
+        cur.execute("DELETE FROM game_rooms WHERE id=?", (room_id,))
+
+    def next_rng_step(self, room_id: int) -> Tuple[int, int]:
+        self.cursor.execute("UPDATE game_rooms SET rng_step = rng_step + 1 WHERE id=? RETURNING seed, rng_step",
+                            (room_id,))
+        return self.cursor.fetchone()
+
+    def add_player(self, player: PlayerState) -> int:
+        self.cursor.execute(f"""
+            INSERT INTO players ({PLAYER_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, player_row(player))
+        player.id = self.cursor.lastrowid
+        return player.id
+
+    def update_player(self, player: PlayerState):
+        self.cursor.execute("""
+            UPDATE players SET name=?, hp=?, max_hp=?, role=?, is_alive=?, is_ready=?, position=?, weapon=?, permanent_effects=?
+            WHERE id=?
+        """, (
+        player.name, player.hp, player.max_hp, player.role, int(player.is_alive), int(player.is_ready), player.position,
+        player.weapon, str(player.permanent_effects), player.id))  # Store as string
+
+    def update_players(self, players: List[PlayerState]):
+        self.cursor.executemany("""
+            UPDATE players SET hp=?, is_alive=?, weapon=?, permanent_effects=? WHERE id=?
+        """, [(p.hp, int(p.is_alive), p.weapon, str(p.permanent_effects), p.id) for p in players])
+
+    def add_to_hand(self, player_id: int, card_id: int):
+        self.cursor.execute("INSERT INTO player_hands (player_id, card_id) VALUES (?, ?)", (player_id, card_id))
+
+    def remove_from_hand(self, player_id: int, card_id: int):
+        self.cursor.execute("DELETE FROM player_hands WHERE player_id=? AND card_id=?", (player_id, card_id))
+
+    def update_hands(self, removed: List[Tuple[int, int]], added: List[Tuple[int, int]]):
+        if removed:
+            self.cursor.executemany("DELETE FROM player_hands WHERE player_id=? AND card_id=?", removed)
+        if added:
+            self.cursor.executemany("INSERT INTO player_hands (player_id, card_id) VALUES (?, ?)", added)
+
+    def setup_game(self, room: RoomState, deck: array):
+        cur = self.cursor
+        player_ids = [(p.id,) for p in room.players.values()]
+        cur.executemany("UPDATE players SET role=? WHERE id=?", [(p.role, p.id) for p in room.players.values()])
+        cur.executemany("DELETE FROM player_hands WHERE player_id=?", player_ids)
+        cur.executemany("INSERT INTO player_hands (player_id, card_id) VALUES (?, ?)",
+                        [(p.id, card_id) for p in room.players.values() for card_id in p.hand])
+        self.replace_piles(room.id, deck, array("H"))
+        self.update_room(room)
+
+    def truncate_deck(self, room_id: int, size: int):
+        self.cursor.execute("DELETE FROM deck WHERE room_id=? AND position>=?", (room_id, size))
+
+    def append_discard(self, room_id: int, start: int, card_ids: List[int]):
+        self.cursor.executemany("INSERT INTO discard_pile (room_id, card_id, position) VALUES (?, ?, ?)",
+                                [(room_id, card_id, start + i) for i, card_id in enumerate(card_ids)])
+
+    def replace_piles(self, room_id: int, deck: array, discard: array):
+        cur = self.cursor
+        cur.execute("DELETE FROM deck WHERE room_id=?", (room_id,))
+        cur.execute("DELETE FROM discard_pile WHERE room_id=?", (room_id,))
+        cur.executemany("INSERT INTO deck (room_id, card_id, position) VALUES (?, ?, ?)",
+                        [(room_id, card_id, i) for i, card_id in enumerate(deck)])
+        self.append_discard(room_id, 0, discard)
+
+    def record_action(self, room_id: int, player_id: int, action: str, card_name: Optional[str],
+                      target_player_id: Optional[int], result: str):
+        self.cursor.execute("""
+            INSERT INTO action_trace (room_id, seq, player_id, action, card_name, target_player_id, result)
+            VALUES (?, (SELECT COALESCE(MAX(seq) + 1, 0) FROM action_trace WHERE room_id = ?), ?, ?, ?, ?, ?)
+        """, (room_id, room_id, player_id, action, card_name, target_player_id, result))
+
+    def add_stats(self, deltas: Deltas):
+        self.cursor.executemany("""
+            INSERT INTO game_stats (metric, key, count, total) VALUES (?, ?, ?, ?)
+            ON CONFLICT (metric, key) DO UPDATE SET count = count + excluded.count, total = total + excluded.total
+        """, [(metric, key, count, total) for (metric, key), (count, total) in deltas.items()])
+
+    # Transactions
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    @contextmanager
+    def snapshot(self):
+        # A pooled read connection does not wait for in-flight write transactions;
+        # without a pool the snapshot shares the writer's connection and waits for its lock
+        if not self.read_pool.size:
+            with self.lock:
+                yield SqliteSnapshot(self.cursor)
+            return
+        with self.read_pool.cursor() as cur:
+            yield SqliteSnapshot(cur)
+
+
+_MISSING = object()
+
+
+class MemoryStorage(Storage):
+    """Game state in dictionaries of rows, as SQLite would hold it.
+
+    Values handed out are copies, so the engine mutates its own objects as with
+    SQLite. A transaction keeps the committed value of every key it changes and
+    restores them on rollback. Snapshots take the lock, so they never see an
+    uncommitted transaction.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # id -> (game_started, current_player_id, roles_assigned, seed, rng_step, winner, started_at, turn)
+        self._rooms: Dict[int, tuple] = {}
+        self._players: Dict[int, tuple] = {}  # id -> row in PLAYER_COLUMNS order
+        self._seats: Dict[int, List[int]] = {}  # room id -> player ids by position
+        self._hands: Dict[int, List[int]] = {}  # player id -> card ids in hand order
+        self._decks: Dict[int, array] = {}
+        self._discards: Dict[int, array] = {}
+        self._traces: Dict[int, List[tuple]] = {}  # room id -> recorded actions
+        self._stats: Dict[Tuple[str, str], Tuple[int, float]] = {}  # (metric, key) -> (count, total)
+        self._next_player_id = 1
+        self._undo: List[Tuple[dict, int, object]] = []
+        self._saved = set()
+
+    def _save(self, table: dict, key: int):
+        """Remember the committed value of table[key] before its first change in the transaction."""
+        if (id(table), key) in self._saved:
+            return
+        self._saved.add((id(table), key))
+        value = table.get(key, _MISSING)
+        if isinstance(value, (list, array)):
+            value = value[:]
+        self._undo.append((table, key, value))
+
+    # Reads
+    def get_room(self, room_id: int, player_ids: Optional[List[int]] = None) -> Optional[RoomState]:
+        row = self._rooms.get(room_id)
+        if row is None:
+            return None
+        game_started, current_player_id, roles_assigned, _, _, winner, started_at, turn = row
+        seats = self._seats[room_id]
+        wanted = set(player_ids) if player_ids is not None else None
+        players = {}
+        for player_id in seats:
+            if wanted is None or player_id in wanted:
+                players[player_id] = player_from_row(self._players[player_id],
+                                                     array("H", self._hands.get(player_id, ())))
+        return RoomState(id=room_id, players=players, game_started=bool(game_started),
+                         current_player_id=current_player_id, roles_assigned=bool(roles_assigned), seats=len(seats),
+                         winner=winner, started_at=started_at, turn=turn)
+
+    def count_deck(self, room_id: int) -> int:
+        return len(self._decks.get(room_id, ()))
+
+    def get_trace(self, room_id: int) -> Optional[Trace]:
+        row = self._rooms.get(room_id)
+        if row is None:
+            return None
+        seats = [(player_id, self._players[player_id][2], bool(self._players[player_id][11]))
+                 for player_id in self._seats[room_id]]
+        return row[3], seats, list(self._traces.get(room_id, ()))
+
+    def get_player(self, player_id: int) -> Optional[PlayerState]:
+        row = self._players.get(player_id)
+        if row is None:
+            return None
+        return player_from_row(row, array("H", self._hands.get(player_id, ())))
+
+    def get_deck(self, room_id: int) -> array:
+        return array("H", self._decks.get(room_id, ()))
+
+    def get_discard(self, room_id: int) -> array:
+        return array("H", self._discards.get(room_id, ()))
+
+    def load_rooms(self) -> StoredRooms:
+        rooms, decks, discards = [], {}, {}
+        for room_id, (game_started, current_player_id, _, _, _, winner, _, _) in self._rooms.items():
+            current = self._players.get(current_player_id)
+            rooms.append((room_id, bool(game_started), winner, current_player_id, bool(current and current[11]),
+                          len(self._seats[room_id])))
+            if game_started and winner is None:
+                decks[room_id] = self.get_deck(room_id)
+                discards[room_id] = self.get_discard(room_id)
+        return rooms, decks, discards
+
+    def load_stats(self) -> List[Tuple[str, str, int, float]]:
+        return [(metric, key, count, total) for (metric, key), (count, total) in self._stats.items()]
+
+    # Writes
+    def add_room(self, room_id: int, seed: int):
+        if room_id in self._rooms:
+            raise ValueError(f"room {room_id} already exists")
+        self._save(self._rooms, room_id)
+        self._save(self._seats, room_id)
+        self._rooms[room_id] = (0, None, 0, seed, 0, None, None, 0)
+        self._seats[room_id] = []
+
+    def update_room(self, room: RoomState):
+        self._save(self._rooms, room.id)
+        _, _, _, seed, rng_step, _, _, _ = self._rooms[room.id]
+        self._rooms[room.id] = (int(room.game_started), room.current_player_id, int(room.roles_assigned), seed,
+                                rng_step, room.winner, room.started_at, room.turn)
+
+    def delete_room(self, room_id: int):
+        for player_id in self._seats.get(room_id, ()):
+            for table in (self._players, self._hands):
+                self._save(table, player_id)
+                table.pop(player_id, None)
+        for table in (self._seats, self._decks, self._discards, self._traces, self._rooms):
+            self._save(table, room_id)
+            table.pop(room_id, None)
+
+    def next_rng_step(self, room_id: int) -> Tuple[int, int]:
+        self._save(self._rooms, room_id)
+        row = self._rooms[room_id]
+        seed, rng_step = row[3], row[4]
+        self._rooms[room_id] = (*row[:4], rng_step + 1, *row[5:])
+        return seed, rng_step + 1
+
+    def add_player(self, player: PlayerState) -> int:
+        if player.id is None:
+            player.id = self._next_player_id
+        self._next_player_id = max(self._next_player_id, player.id + 1)
+        self._save(self._players, player.id)
+        self._save(self._seats, player.room_id)
+        self._players[player.id] = player_row(player)
+        self._seats.setdefault(player.room_id, []).append(player.id)
+        return player.id
+
+    def update_player(self, player: PlayerState):
+        row = self._players.get(player.id)
+        if row is None:
+            return
+        self._save(self._players, player.id)
+        # room_id and is_bot are not updated, as with SQLite
+        self._players[player.id] = (row[0], row[1], *player_row(player)[2:11], row[11])
+
+    def update_players(self, players: List[PlayerState]):
+        for player in players:
+            self.update_player(player)
+
+    def add_to_hand(self, player_id: int, card_id: int):
+        self._save(self._hands, player_id)
+        self._hands.setdefault(player_id, []).append(card_id)
+
+    def remove_from_hand(self, player_id: int, card_id: int):
+        hand = self._hands.get(player_id)
+        if hand and card_id in hand:
+            self._save(self._hands, player_id)
+            hand.remove(card_id)
+
+    def update_hands(self, removed: List[Tuple[int, int]], added: List[Tuple[int, int]]):
+        for player_id, card_id in removed:
+            self.remove_from_hand(player_id, card_id)
+        for player_id, card_id in added:
+            self.add_to_hand(player_id, card_id)
+
+    def setup_game(self, room: RoomState, deck: array):
+        for player in room.players.values():
+            self._save(self._players, player.id)
+            self._save(self._hands, player.id)
+            row = self._players[player.id]
+            self._players[player.id] = (*row[:5], player.role, *row[6:])
+            self._hands[player.id] = list(player.hand)
+        self.replace_piles(room.id, deck, array("H"))
+        self.update_room(room)
+
+    def truncate_deck(self, room_id: int, size: int):
+        self._save(self._decks, room_id)
+        del self._decks.setdefault(room_id, array("H"))[size:]
+
+    def append_discard(self, room_id: int, start: int, card_ids: List[int]):
+        self._save(self._discards, room_id)
+        discard = self._discards.setdefault(room_id, array("H"))
+        del discard[start:]
+        discard.extend(card_ids)
+
+    def replace_piles(self, room_id: int, deck: array, discard: array):
+        self._save(self._decks, room_id)
+        self._save(self._discards, room_id)
+        self._decks[room_id] = array("H", deck)
+        self._discards[room_id] = array("H", discard)
+
+    def record_action(self, room_id: int, player_id: int, action: str, card_name: Optional[str],
+                      target_player_id: Optional[int], result: str):
+        self._save(self._traces, room_id)
+        self._traces.setdefault(room_id, []).append((player_id, action, card_name, target_player_id, result))
+
+    def add_stats(self, deltas: Deltas):
+        for key, (count, total) in deltas.items():
+            self._save(self._stats, key)
+            old_count, old_total = self._stats.get(key, (0, 0.0))
+            self._stats[key] = (old_count + count, old_total + total)
+
+    # Transactions
+    def commit(self):
+        self._undo.clear()
+        self._saved.clear()
+
+    def rollback(self):
+        for table, key, value in reversed(self._undo):
+            if value is _MISSING:
+                table.pop(key, None)
+            else:
+                table[key] = value
+        self._undo.clear()
+        self._saved.clear()
+
+    @contextmanager
+    def snapshot(self):
+        with self.lock:
+            yield self
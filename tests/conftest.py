@@ -0,0 +1,16 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """Point the engine at a storage backend with empty caches."""
+    def use(storage):
+        monkeypatch.setattr(main, "storage", storage)
+        monkeypatch.setattr(main, "db_lock", storage.lock)
+        monkeypatch.setattr(main, "_room_piles", {})
+        monkeypatch.setattr(main, "_room_views", {})
+        storage.open()
+        return storage
+    return use
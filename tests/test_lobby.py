@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from domain import MAX_PLAYERS
+from main import OpenRoomIndex
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_pages_match_a_plain_scan(seed):
+    """Random updates and removals; every page and cursor walk agrees with a filtered sort."""
+    rng = random.Random(seed)
+    index = OpenRoomIndex()
+    rooms = {}  # room id -> players, open rooms only
+    for _ in range(2000):
+        room_id = rng.randrange(300)
+        if rng.random() < 0.2:
+            index.remove(room_id)
+            rooms.pop(room_id, None)
+            continue
+        players, started = rng.randint(0, MAX_PLAYERS), rng.random() < 0.2
+        index.update(room_id, players, started)
+        if started or players >= MAX_PLAYERS:
+            rooms.pop(room_id, None)
+        else:
+            rooms[room_id] = players
+    assert len(index) == len(rooms)
+
+    for min_free_seats in range(0, MAX_PLAYERS + 1):
+        expected = sorted((room_id, players) for room_id, players in rooms.items()
+                          if MAX_PLAYERS - players >= max(min_free_seats, 1))
+        limit = rng.randint(1, 40)
+        walked, after = [], None
+        while True:
+            page = index.page(min_free_seats, after, limit)
+            assert len(page) <= limit
+            walked.extend(page)
+            if len(page) < limit:
+                break
+            after = page[-1][0]
+        assert walked == expected
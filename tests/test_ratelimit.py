@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from ratelimit import RateLimiter, Rejected, WriteGate, parse_rate
+
+
+@pytest.mark.parametrize("spec, expected", [("10/20", (10.0, 20.0)), ("5", (5.0, 5.0)), ("0.5", (0.5, 1.0)),
+                                            ("0", None), ("0/10", None)])
+def test_parse_rate(spec, expected):
+    assert parse_rate(spec) == expected
+
+
+def test_rate_limiter_refills_per_key():
+    limiter = RateLimiter("test", rate=2.0, burst=3.0)
+    for _ in range(3):
+        limiter.acquire("a", now=0.0)
+    with pytest.raises(Rejected) as e:
+        limiter.acquire("a", now=0.0)
+    assert e.value.retry_after == pytest.approx(0.5)
+    assert e.value.retry_after_header == "1"
+    limiter.acquire("b", now=0.0)  # other keys have their own bucket
+    limiter.acquire("a", now=0.5)
+    with pytest.raises(Rejected):
+        limiter.acquire("a", now=0.5)
+    assert limiter.stats()["admitted"] == 5 and limiter.stats()["rejected"] == 2
+
+
+def test_rate_limiter_sweeps_full_buckets():
+    limiter = RateLimiter("test", rate=1.0, burst=1.0, max_keys=2)
+    limiter.acquire("a", now=0.0)
+    limiter.acquire("b", now=0.0)
+    limiter.acquire("c", now=0.5)  # a and b are half full: nothing to sweep
+    assert limiter.stats()["keys"] == 3
+    limiter.acquire("d", now=5.0)
+    assert limiter.stats()["keys"] == 1
+
+
+def test_write_gate_sheds_when_the_queue_is_full():
+    gate = WriteGate(limit=1, max_queue=0)
+    gate.acquire()
+    with pytest.raises(Rejected) as e:
+        gate.acquire()
+    assert e.value.reason == "queue"
+    gate.release()
+    gate.acquire()
+    assert gate.stats()["shed"] == 1 and gate.stats()["admitted"] == 2
+
+
+def test_write_gate_times_out_in_the_queue():
+    gate = WriteGate(limit=1, max_queue=1, timeout=0.01)
+    gate.acquire()
+    with pytest.raises(Rejected) as e:
+        gate.acquire()
+    assert e.value.reason == "timeout"
+    assert gate.stats()["timed_out"] == 1 and gate.queued == 0
+
+
+def test_write_gate_admits_a_queued_writer_on_release():
+    gate = WriteGate(limit=1, max_queue=1, timeout=5.0)
+    gate.acquire()
+    admitted = threading.Event()
+
+    def writer():
+        gate.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while gate.queued == 0:
+        time.sleep(0.001)
+    assert not admitted.is_set()
+    gate.release()
+    thread.join(1.0)
+    assert admitted.is_set() and gate.active == 1 and gate.stats()["peak_queued"] == 1
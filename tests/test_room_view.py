@@ -0,0 +1,47 @@
+import main
+from domain import card_name
+from storage import MemoryStorage
+
+
+def started_room(storage):
+    main.open_room(1, seed=3)
+    ids = [main.add_player(1, f"p{seat}")["player_id"] for seat in range(5)]
+    for player_id in ids:
+        main.set_ready(1, player_id)
+    main.start_game(1)
+    return storage.get_room(1)
+
+
+def test_players_see_only_their_own_hand_and_role(engine):
+    room = started_room(engine(MemoryStorage()))
+    view = main.build_room_view(1, main.room_watchers.version(1))
+
+    for viewer in [None, *room.players]:
+        state = view.project(viewer)
+        assert state["current_player"] == room.current_player_id
+        for seen, player in zip(state["players"], room.players.values()):
+            assert seen["id"] == player.id and seen["hand_count"] == len(player.hand)
+            if player.id == viewer:
+                assert seen["hand"] == [card_name(card_id) for card_id in player.hand]
+                assert seen["role"] == player.role
+            else:
+                assert "hand" not in seen
+                assert seen["role"] == (player.role if player.role == "шериф" else None)
+    # Projections never write into the shared public state
+    assert all("hand" not in seen for seen in view.public["players"])
+    assert view.project(12345) is view.public
+
+
+def test_unchanged_private_parts_are_carried_over(engine):
+    storage = engine(MemoryStorage())
+    room = started_room(storage)
+    first = main.build_room_view(1, main.room_watchers.version(1))
+    current = room.current_player_id
+    with main.db_transaction():
+        main.apply_action(1, main.PlayerAction(player_id=current, action="pass"))
+        main.room_changed(1)
+    second = main.build_room_view(1, main.room_watchers.version(1))
+
+    assert second.version > first.version
+    for player_id in room.players:
+        assert second.private[player_id] is first.private[player_id]
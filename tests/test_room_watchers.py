@@ -0,0 +1,47 @@
+import asyncio
+import threading
+
+from main import RoomWatchers
+
+
+def test_wait_times_out_and_cleans_up():
+    watchers = RoomWatchers()
+    since = watchers.bump(1)
+    assert asyncio.run(watchers.wait(1, since, 0.01)) == since
+    assert watchers._events == {} and watchers._waiters == {}
+
+
+def test_changed_room_answers_at_once():
+    watchers = RoomWatchers()
+    since = watchers.bump(1)
+    watchers.bump(2)
+    assert watchers.version(2) > since
+    assert asyncio.run(watchers.wait(1, since - 1, 10.0)) == since
+
+
+def test_bump_from_another_thread_wakes_every_waiter():
+    watchers = RoomWatchers()
+    since = watchers.bump(1)
+
+    async def scenario():
+        waits = [asyncio.create_task(watchers.wait(1, since, 10.0)) for _ in range(3)]
+        other = asyncio.create_task(watchers.wait(2, 0, 10.0))
+        await asyncio.sleep(0.01)
+        assert watchers._waiters == {1: 3, 2: 1}
+        threading.Thread(target=watchers.bump, args=(1,)).start()
+        versions = await asyncio.wait_for(asyncio.gather(*waits), 5.0)
+        assert not other.done()
+        other.cancel()
+        return versions
+
+    versions = asyncio.run(scenario())
+    assert versions == [watchers.version(1)] * 3 and versions[0] > since
+    assert watchers._events == {} and watchers._waiters == {}
+
+
+def test_forget_drops_the_version():
+    watchers = RoomWatchers()
+    watchers.bump(1)
+    watchers.forget(1)
+    assert watchers.version(1) == 0
+    assert watchers.bump(1) > 1  # versions are never reused
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from main import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def build():
+        runs.append(1)
+        started.set()
+        release.wait(5.0)
+        return object()
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", build)))
+    leader.start()
+    started.wait(5.0)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", build))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flight.shared < 4:
+        release.wait(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5.0)
+
+    assert len(runs) == 1 and len(results) == 5
+    assert all(result is results[0] for result in results)
+    assert (flight.executed, flight.shared) == (1, 4)
+    # Done calls are forgotten: the next call runs the function again
+    flight.do("k", build)
+    assert len(runs) == 2
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5.0)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("k", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5.0)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flight.shared < 1:
+        release.wait(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5.0)
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert flight.do("k", lambda: 7) == 7
+
+
+def test_keys_do_not_share():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flight.do("c", lambda: {}["missing"])
+    assert flight.executed == 3 and flight.shared == 0
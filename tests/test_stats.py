@@ -0,0 +1,39 @@
+import pytest
+
+import main
+from stats import GameStats
+from storage import MemoryStorage
+
+
+def test_timeout_passes_are_counted(engine, monkeypatch):
+    storage = engine(MemoryStorage())
+    monkeypatch.setattr(main, "game_stats", GameStats())
+    main.open_room(1, seed=4)
+    ids = [main.add_player(1, f"p{seat}")["player_id"] for seat in range(4)]
+    for player_id in ids:
+        main.set_ready(1, player_id)
+    main.start_game(1)
+    current = storage.get_room(1).current_player_id
+    with main.db_transaction():
+        main.apply_action(1, main.PlayerAction(player_id=current, action="pass"))
+    main.process_expired_timers([(("turn", 1), storage.get_room(1).current_player_id)])
+
+    assert storage.get_room(1).current_player_id not in (None, current)
+    assert main.game_stats.report()["actions"]["pass"]["count"] == 2
+    assert dict(((m, k), c) for m, k, c, _ in storage.load_stats())[("action", "pass")] == 2
+
+
+def test_started_game_is_not_dealt_again(engine, monkeypatch):
+    storage = engine(MemoryStorage())
+    monkeypatch.setattr(main, "game_stats", GameStats())
+    main.open_room(1, seed=4)
+    for seat in range(4):
+        main.set_ready(1, main.add_player(1, f"p{seat}")["player_id"])
+    main.start_game(1)
+    dealt = [(p.role, list(p.hand)) for p in storage.get_room(1).players.values()]
+
+    with pytest.raises(main.HTTPException) as e:
+        main.start_game(1)
+    assert e.value.status_code == 400
+    assert [(p.role, list(p.hand)) for p in storage.get_room(1).players.values()] == dealt
+    assert main.game_stats.report()["games_started"] == 1
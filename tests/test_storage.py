@@ -0,0 +1,135 @@
+import random
+from array import array
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from domain import PlayerState, RoomState
+from storage import MemoryStorage, SqliteStorage
+
+ROOM = 1
+
+
+def play(storage, seed: int, actions: int = 200):
+    """Play a seeded five-player game with random moves; returns the results and the final state."""
+    main.open_room(ROOM, seed=seed)
+    ids = [main.add_player(ROOM, f"p{seat}")["player_id"] for seat in range(5)]
+    for player_id in ids:
+        main.set_ready(ROOM, player_id)
+    main.start_game(ROOM)
+
+    moves = random.Random(seed)
+    results = []
+    for _ in range(actions):
+        room = storage.get_room(ROOM)
+        if room.winner is not None:
+            break
+        player = room.players[room.current_player_id]
+        target = moves.choice([p.id for p in room.players.values() if p.id != player.id and p.is_alive])
+        choice = moves.random()
+        if player.hand and choice < 0.6:
+            action = main.PlayerAction(player_id=player.id, action="play_card", target_player_id=target,
+                                       card_name=main.card_name(moves.choice(player.hand)))
+        elif choice < 0.8:
+            action = main.PlayerAction(player_id=player.id, action="shoot", target_player_id=target)
+        else:
+            action = main.PlayerAction(player_id=player.id, action="pass")
+        try:
+            with main.db_transaction():
+                results.append(main.apply_action(ROOM, action))
+        except HTTPException as e:
+            results.append(e.detail)
+
+    room = storage.get_room(ROOM)
+    players = [(p.name, p.hp, p.role, p.is_alive, list(p.hand), p.weapon, p.permanent_effects)
+               for p in room.players.values()]
+    state = (room.current_player_id, room.winner, players, list(storage.get_deck(ROOM)),
+             list(storage.get_discard(ROOM)))
+    return results, state
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_backends_play_the_same_game(engine, tmp_path, seed):
+    sqlite = play(engine(SqliteStorage(str(tmp_path / "game.db"), read_pool_size=0)), seed)
+    memory = play(engine(MemoryStorage()), seed)
+    assert memory == sqlite
+    assert len(sqlite[0]) > 20
+
+
+def dump(storage: MemoryStorage):
+    """Everything a reader of the storage can see."""
+    rooms, decks, discards = storage.load_rooms()
+    rooms.sort()  # a restored room comes back at the end of the dict
+    details = []
+    for room_id, *_ in rooms:
+        room = storage.get_room(room_id)
+        details.append((room.current_player_id, room.winner, room.seats, storage.get_trace(room_id),
+                        [(p.id, p.name, p.hp, p.role, list(p.hand)) for p in room.players.values()]))
+    return rooms, decks, discards, details, sorted(storage.load_stats())
+
+
+def test_memory_rollback_restores_committed_state():
+    storage = MemoryStorage()
+    storage.open()
+    storage.add_room(1, seed=7)
+    storage.add_room(2, seed=8)
+    players = [PlayerState(None, 1, name, position=seat) for seat, name in enumerate("abcd")]
+    for player in players:
+        storage.add_player(player)
+        player.role = "бандит"
+        player.hand = array("H", [player.id * 4 + i for i in range(4)])
+    room = RoomState(1, {p.id: p for p in players}, game_started=True, current_player_id=players[0].id,
+                     roles_assigned=True)
+    storage.setup_game(room, array("H", range(50, 70)))
+    storage.record_action(1, players[0].id, "pass", None, None, "{}")
+    storage.add_stats({("games", "started"): (1, 0.0)})
+    storage.commit()
+    committed = dump(storage)
+
+    # Every kind of write, some of them twice on the same key
+    storage.next_rng_step(1)
+    room.current_player_id = players[1].id
+    room.winner = "бандиты"
+    storage.update_room(room)
+    players[0].hp = 0
+    storage.update_players(players[:2])
+    storage.update_player(players[2])
+    storage.add_to_hand(players[0].id, 99)
+    storage.remove_from_hand(players[1].id, players[1].hand[0])
+    storage.update_hands([(players[3].id, players[3].hand[0])], [(players[3].id, 98)])
+    storage.truncate_deck(1, 10)
+    storage.append_discard(1, 0, [60, 61])
+    storage.append_discard(1, 2, [62])
+    storage.replace_piles(1, array("H", [1, 2]), array("H", [3]))
+    storage.record_action(1, players[1].id, "shoot", None, players[2].id, "{}")
+    storage.add_stats({("games", "started"): (2, 0.0), ("card", "Бэнг"): (1, 1.0)})
+    storage.add_player(PlayerState(None, 2, "e"))
+    storage.add_room(3, seed=9)
+    storage.delete_room(1)
+    assert dump(storage) != committed
+    storage.rollback()
+
+    assert dump(storage) == committed
+    # The undo log starts afresh: a committed change survives a later rollback
+    storage.next_rng_step(2)
+    storage.commit()
+    storage.rollback()
+    assert storage.next_rng_step(2) == (8, 2)
+
+
+def test_sqlite_upgrades_an_older_schema(tmp_path):
+    path = str(tmp_path / "game.db")
+    storage = SqliteStorage(path, read_pool_size=0)
+    storage.open()
+    storage.add_room(1, seed=7)
+    # The room table as the previous schema version left it
+    storage.cursor.execute("ALTER TABLE game_rooms DROP COLUMN turn")
+    storage.cursor.execute("PRAGMA user_version = 3")
+    storage.commit()
+    storage.close()
+
+    storage = SqliteStorage(path, read_pool_size=0)
+    storage.open()
+    assert storage.get_room(1).turn == 0
+    storage.close()
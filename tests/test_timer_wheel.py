@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from timer_wheel import TimerWheel
+
+
+@pytest.mark.parametrize("slots, levels", [(4, 1), (4, 2), (2, 3), (8, 3), (64, 4)])
+def test_fires_at_deadline(slots, levels):
+    """Random arms, re-arms and cancels fire exactly when a plain deadline map says."""
+    rng = random.Random(slots * 10 + levels)
+    wheel = TimerWheel(tick=1.0, slots=slots, levels=levels)
+    deadlines = {}
+    for now in range(1, 2000):
+        for _ in range(rng.randint(0, 3)):
+            key = rng.randrange(50)
+            if rng.random() < 0.2:
+                assert wheel.cancel(key) == (key in deadlines)
+                deadlines.pop(key, None)
+            else:
+                delay = rng.choice([1, 2, 3, rng.randint(1, slots ** levels * 3)])
+                wheel.arm(key, delay, payload=(key, now))
+                deadlines[key] = now - 1 + delay
+        expired = wheel.advance(float(now))
+        due = {key for key, deadline in deadlines.items() if deadline <= now}
+        assert {key for key, _ in expired} == due, now
+        for key in due:
+            del deadlines[key]
+        assert len(wheel) == len(deadlines)
+
+
+def test_payload_and_deadline():
+    wheel = TimerWheel(tick=0.5, start=10.0)
+    wheel.arm("turn", 1.2, payload=7)  # rounded up to three ticks
+    assert wheel.deadline("turn") == 11.5
+    assert wheel.advance(11.4) == []
+    assert wheel.advance(11.5) == [("turn", 7)]
+    assert "turn" not in wheel and wheel.deadline("turn") is None
+
+
+def test_rearm_replaces_timer():
+    wheel = TimerWheel(slots=4, levels=2)
+    wheel.arm("idle", 3, payload="first")
+    wheel.arm("idle", 10, payload="second")
+    assert wheel.advance(9) == []
+    assert wheel.advance(10) == [("idle", "second")]
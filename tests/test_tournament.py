@@ -0,0 +1,75 @@
+import pytest
+
+import main
+from storage import MemoryStorage
+from tournament import split_tables
+
+
+@pytest.fixture
+def scheduler(engine, monkeypatch):
+    """Empty bot and tournament queues over a fresh memory storage."""
+    monkeypatch.setattr(main, "_bot_rooms", set())
+    monkeypatch.setattr(main, "tournaments", {})
+    monkeypatch.setattr(main, "_match_tournaments", {})
+    monkeypatch.setattr(main, "_finished_matches", [])
+    return engine(MemoryStorage())
+
+
+@pytest.mark.parametrize("table_size", range(4, main.MAX_PLAYERS + 1))
+def test_split_tables_keeps_table_size(table_size):
+    for count in range(40):
+        players = [f"p{i}" for i in range(count)]
+        tables, rest = split_tables(players, table_size)
+        assert sorted(sum(tables, []) + rest) == sorted(players)
+        assert all(4 <= len(table) <= table_size for table in tables)
+        assert len(rest) <= 3 and (not rest or count < 4 or all(len(table) == table_size for table in tables))
+        if tables:
+            assert max(map(len, tables)) - min(map(len, tables)) <= 1
+            assert len(tables) == -(-(count - len(rest)) // table_size)
+
+
+@pytest.mark.parametrize("players, table_size, seed", [(8, 4, 1), (13, 5, 2), (23, 7, 3)])
+def test_bot_tournament_reaches_champions(scheduler, players, table_size, seed):
+    """Scheduler ticks without turn timeouts: bots play every match to its end."""
+    names = [f"bot{i}" for i in range(players)]
+    main.create_tournament(1, main.TournamentRequest(players=names, table_size=table_size, first_room=100,
+                                                     bots=True, seed=seed))
+    tournament = main.tournaments[1]
+    for _ in range(10 * tournament.max_turns):
+        if tournament.champions is not None:
+            break
+        main.process_bot_turns(main.take_bot_rooms())
+        main.advance_tournaments(main.take_finished_matches())
+    assert tournament.champions is not None
+    assert set(tournament.champions) <= set(names)
+    assert all(match.winners is not None for match in tournament.matches.values())
+
+
+def pass_turns(storage, room_id: int, turns: int):
+    for _ in range(turns):
+        room = storage.get_room(room_id)
+        with main.db_transaction():
+            main.apply_action(room_id, main.PlayerAction(player_id=room.current_player_id, action="pass"))
+    return storage.get_room(room_id)
+
+
+def test_turn_cap_decides_matches_on_health(scheduler):
+    main.create_tournament(1, main.TournamentRequest(players=["a", "b", "c", "d"], first_room=100, seed=5,
+                                                     max_turns=3))
+    room = pass_turns(scheduler, 100, 3)
+    assert room.turn == 3
+    assert room.winner == main.health_winner(room) == "шериф"  # nobody has lost health: a tie
+    with pytest.raises(main.HTTPException):
+        main.apply_action(100, main.PlayerAction(player_id=room.current_player_id, action="pass"))
+    assert main.take_finished_matches() == [(100, [p.id for p in room.players.values()
+                                                   if p.role in ("шериф", "помощник")])]
+
+
+def test_turn_cap_leaves_other_games_alone(scheduler):
+    main.open_room(1, seed=5)
+    ids = [main.add_player(1, f"p{seat}")["player_id"] for seat in range(4)]
+    for player_id in ids:
+        main.set_ready(1, player_id)
+    main.start_game(1)
+    room = pass_turns(scheduler, 1, 250)
+    assert room.turn == 250 and room.winner is None
@@ -0,0 +1,116 @@
+import threading
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class TimerWheel:
+    """Hierarchical timer wheel.
+
+    Timers are identified by a hashable key; arming a key again replaces its
+    previous timer. Level 0 has `slots` buckets of one tick each, every next
+    level covers `slots` buckets of the level below, and timers are cascaded
+    down as their bucket comes up. arm() and cancel() are O(1); advance() costs
+    O(1) per elapsed tick plus the timers it moves or fires.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, start: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._origin = start
+        self._current = 0  # ticks elapsed since start
+        # level -> slot -> {key: (deadline_tick, payload)}
+        self._wheels: List[List[Dict[Hashable, Tuple[int, object]]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        self._where: Dict[Hashable, Tuple[int, int]] = {}  # key -> (level, slot)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def _place(self, key: Hashable, deadline: int, payload: object):
+        diff = max(deadline - self._current, 0)
+        level = 0
+        span = self.slots
+        while diff >= span and level < self.levels - 1:
+            level += 1
+            span *= self.slots
+        if diff >= span:
+            # Beyond the wheel: park in the furthest bucket, re-placed when it comes up
+            bucket_tick = self._current + span - 1
+        else:
+            bucket_tick = deadline
+        slot = (bucket_tick // self.slots ** level) % self.slots
+        self._wheels[level][slot][key] = (deadline, payload)
+        self._where[key] = (level, slot)
+
+    def _remove(self, key: Hashable) -> bool:
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, slot = where
+        del self._wheels[level][slot][key]
+        return True
+
+    def arm(self, key: Hashable, delay: float, payload: object = None):
+        """(Re)start the timer for key to fire after delay seconds."""
+        ticks = max(1, -int(-delay // self.tick))  # ceil, at least one tick
+        with self._lock:
+            self._remove(key)
+            self._place(key, self._current + ticks, payload)
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._remove(key)
+
+    def advance(self, now: float) -> List[Tuple[Hashable, object]]:
+        """Move the wheel to time now and return the (key, payload) of expired timers."""
+        target = int((now - self._origin) // self.tick)
+        expired: List[Tuple[Hashable, object]] = []
+        with self._lock:
+            while self._current < target:
+                if not self._where:
+                    self._current = target
+                    break
+                self._current += 1
+                self._cascade()
+                bucket = self._wheels[0][self._current % self.slots]
+                if bucket:
+                    due = list(bucket.items())
+                    bucket.clear()
+                    for key, (deadline, payload) in due:
+                        del self._where[key]
+                        if deadline > self._current:
+                            # Parked beyond a wheel of one level, which never cascades
+                            self._place(key, deadline, payload)
+                        else:
+                            expired.append((key, payload))
+        return expired
+
+    def _cascade(self):
+        # Higher levels first, so timers moved down can land in a bucket that is
+        # about to be cascaded or fired in this same tick
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if self._current % span:
+                continue
+            bucket = self._wheels[level][(self._current // span) % self.slots]
+            if not bucket:
+                continue
+            moved = list(bucket.items())
+            bucket.clear()
+            for key, (deadline, payload) in moved:
+                del self._where[key]
+                self._place(key, deadline, payload)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        """Time at which key fires, or None if it is not armed."""
+        with self._lock:
+            where = self._where.get(key)
+            if where is None:
+                return None
+            level, slot = where
+            return self._origin + self._wheels[level][slot][key][0] * self.tick
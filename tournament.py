@@ -0,0 +1,124 @@
+"""Knockout tournaments over many rooms.
+
+The entrants of a round are shuffled onto balanced tables of 4 to table_size
+players (see split_tables). Winners go on to the next round: they are seated as
+soon as a full table of them waits, the rest once their round is over; one to
+three left over sit a round out. The tournament ends when fewer than four
+players are left. Tournament only plans: the server creates the rooms of the
+tables it hands out and reports back the winners of every finished match.
+"""
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+MIN_TABLE = 4  # players a game needs
+
+
+class Match:
+    __slots__ = ("room_id", "round", "entrants", "winners")
+
+    def __init__(self, room_id: int, round: int, entrants: Dict[int, str]):
+        self.room_id = room_id
+        self.round = round
+        self.entrants = entrants  # player id -> entrant
+        self.winners: Optional[List[str]] = None
+
+
+def split_tables(players: List[str], table_size: int) -> Tuple[List[List[str]], List[str]]:
+    """Seat players at tables of 4 to table_size; returns the tables and the players left over.
+
+    Everyone is seated at as few tables as possible, sizes differing by one at
+    most. When no split fits (5 players at tables of 4) only full tables are
+    seated and the rest, never more than three, are left over.
+    """
+    count = min(-(-len(players) // table_size), len(players) // MIN_TABLE)
+    seated = min(len(players), count * table_size)
+    return [players[i:seated:count] for i in range(count)], players[seated:]
+
+
+class Tournament:
+    def __init__(self, id: int, players: List[str], table_size: int, first_room: int, bots: bool,
+                 seed: Optional[int], max_turns: int = 0):
+        self.id = id
+        self.table_size = table_size
+        self.bots = bots
+        self.max_turns = max_turns  # turns after which a match is decided on health; 0: no limit
+        self.rng = random.Random(seed)
+        self.next_room = first_room
+        self.round = 1  # first round that is not over
+        self.waiting: Dict[int, List[str]] = {1: list(players)}  # round -> entrants without a table
+        self.running: Dict[int, int] = {}  # round -> matches taken to be seated or in play
+        self.matches: Dict[int, Match] = {}  # room id -> match
+        self.champions: Optional[List[str]] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.matches_finished = 0
+
+    def next_tables(self) -> List[Tuple[int, List[str]]]:
+        """Take the entrants that can be seated now, as (round, entrants) per table."""
+        tables = []
+
+        def take(round: int, entrants: List[str]):
+            tables.append((round, entrants))
+            self.running[round] = self.running.get(round, 0) + 1
+
+        while self.champions is None:
+            waiting = self.waiting.pop(self.round, [])
+            self.rng.shuffle(waiting)
+            seated, rest = split_tables(waiting, self.table_size)
+            for entrants in seated:
+                take(self.round, entrants)
+            if rest:
+                self.waiting.setdefault(self.round + 1, []).extend(rest)
+            following = self.waiting.get(self.round + 1, [])
+            while len(following) >= self.table_size:
+                take(self.round + 1, following[:self.table_size])
+                del following[:self.table_size]
+            if not self.advance():
+                break
+        return tables
+
+    def advance(self) -> bool:
+        """Move past the rounds that are over; True when the round changed."""
+        moved = False
+        # A round is over once all of its entrants are seated and all of its matches finished
+        while self.champions is None and not self.waiting.get(self.round) and not self.running.get(self.round):
+            following = self.waiting.get(self.round + 1, [])
+            later = any(count for round, count in self.running.items() if round > self.round) or \
+                any(entrants for round, entrants in self.waiting.items() if round > self.round + 1)
+            if len(following) < MIN_TABLE and not later:
+                self.champions = following
+                self.finished = time.time()
+            else:
+                self.round += 1
+                moved = True
+        return moved
+
+    def requeue(self, tables: List[Tuple[int, List[str]]]):
+        for round, entrants in tables:
+            self.running[round] -= 1
+            self.waiting.setdefault(round, []).extend(entrants)
+
+    def finish_match(self, room_id: int, winner_ids: List[int]):
+        match = self.matches[room_id]
+        match.winners = [match.entrants[player_id] for player_id in winner_ids if player_id in match.entrants]
+        self.running[match.round] -= 1
+        self.matches_finished += 1
+        self.waiting.setdefault(match.round + 1, []).extend(match.winners)
+        self.advance()
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.time()) - self.created
+        return {
+            "id": self.id,
+            "round": self.round,
+            "max_turns": self.max_turns,
+            "champions": self.champions,
+            "matches_started": len(self.matches),
+            "matches_running": sum(self.running.values()),
+            "matches_finished": self.matches_finished,
+            "matches_per_minute": round(self.matches_finished / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "players_waiting": sum(len(entrants) for entrants in self.waiting.values()),
+            "matches": [{"room_id": m.room_id, "round": m.round, "players": list(m.entrants.values()),
+                         "winners": m.winners} for m in self.matches.values()],
+        }
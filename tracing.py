@@ -0,0 +1,148 @@
+"""Lightweight in-process tracing written to a local JSONL file.
+
+A trace is opened around a unit of work (Tracer.trace) and stages inside it
+open child spans (Tracer.span); the current span lives in a context variable,
+so nested calls need no extra arguments. When the root span ends the trace is
+kept if it is sampled (sample_rate) or slow (slow_ms) and written as one line in
+the OTLP/JSON shape of an ExportTraceServiceRequest, which the OpenTelemetry
+collector reads with its otlpjsonfile receiver. Files rotate by size.
+
+With no path the tracer is disabled and spans cost one context variable lookup.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_ERROR = 2
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, span_id: str, parent_id: Optional[str], start: int, attributes: Dict[str, object]):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = start  # perf_counter_ns
+        self.end = start
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "wall_start", "perf_start")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+        self.wall_start = time.time_ns()
+        self.perf_start = time.perf_counter_ns()
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("tracing_span", default=None)  # (Trace, Span)
+
+
+def _value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: Dict[str, object]) -> List[dict]:
+    return [{"key": key, "value": _value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Tracer:
+    def __init__(self, path: Optional[str] = None, sample_rate: float = 0.01, slow_ms: Optional[float] = None,
+                 max_bytes: int = 10 * 1024 * 1024, backups: int = 5, service: str = "bang_server"):
+        self.enabled = bool(path)
+        self.sample_rate = sample_rate
+        self.slow_ns = int(slow_ms * 1e6) if slow_ms is not None else None
+        self.service = service
+        self.exported = 0
+        self._ids = random.Random()
+        if self.enabled:
+            # A dedicated logger: the handler serializes writers and rotates the file
+            self._log = logging.getLogger(f"{__name__}.{path}")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                           encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log.addHandler(handler)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Root span of a trace; attributes are copied onto every span of the trace."""
+        if not self.enabled:
+            yield
+            return
+        trace = Trace(f"{self._ids.getrandbits(128):032x}")
+        try:
+            with self._span(trace, None, name, attributes):
+                yield
+        finally:
+            root = trace.spans[0]
+            sampled = self._ids.random() < self.sample_rate
+            if sampled or (self.slow_ns is not None and root.end - root.start >= self.slow_ns):
+                self._export(trace, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Child span of the current span; a no-op outside of a trace."""
+        current = _current.get()
+        if current is None:
+            yield
+            return
+        trace, parent = current
+        with self._span(trace, parent.span_id, name, attributes):
+            yield
+
+    @contextmanager
+    def _span(self, trace: Trace, parent_id: Optional[str], name: str, attributes: Dict[str, object]):
+        span = Span(name, f"{self._ids.getrandbits(64):016x}", parent_id, time.perf_counter_ns(), attributes)
+        trace.spans.append(span)
+        token = _current.set((trace, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end = time.perf_counter_ns()
+            _current.reset(token)
+
+    def _export(self, trace: Trace, common: Dict[str, object]):
+        offset = trace.wall_start - trace.perf_start
+        spans = []
+        for span in trace.spans:
+            record = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": SPAN_KIND_SERVER if span.parent_id is None else SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(span.start + offset),
+                "endTimeUnixNano": str(span.end + offset),
+                "attributes": _attributes({**common, **span.attributes,
+                                           "duration_ms": round((span.end - span.start) / 1e6, 3)}),
+                "status": {"code": STATUS_ERROR, "message": span.error} if span.error else {},
+            }
+            if span.parent_id is not None:
+                record["parentSpanId"] = span.parent_id
+            spans.append(record)
+        self._log.info(json.dumps({"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": self.service})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}, ensure_ascii=False))
+        self.exported += 1